@@ -0,0 +1,44 @@
+# Build the color lookup table used by the cube scanner
+#
+# The sticker colors of earlier scans are grouped into the 6 cube colors
+# and every cell of a quantized RGB cube is given the color it belongs to.
+#
+# Usage:
+#   python3 build_color_lut.py [scan folder ...]
+#
+# Each scan folder holds the face0.jpg ... face5.jpg images of one scan.
+# The Cube folder is used if no folders are given.
+#
+import sys
+
+import numpy as np
+
+from rubik_colors import build_lut, save_lut, LUT_SIZE, LUT_UNKNOWN
+from rubik_scan import RubikScan, FaceSet, COLOR_LUT_FILE
+from rubik_camera import FakeCamera
+
+
+folders = sys.argv[1:]
+if (len(folders) == 0):
+    folders = ["Cube"]
+
+# Sample the stickers of every scan
+# The scanner is only used for its sticker sampling, it gets a camera
+# stand in so no camera is opened.
+scanner = RubikScan(None, FakeCamera())
+scans = []
+for folder in folders:
+    faces = FaceSet(folder)
+    scans.append(scanner.sample_faces(faces.get_all()))
+    print("Sampled " + folder)
+
+points = np.concatenate([s.reshape(-1, 3) for s in scans])
+
+# The centers of the first scan are one sample of each color
+lut = build_lut(points, scans[0][:, 4, :], LUT_SIZE)
+save_lut(lut, COLOR_LUT_FILE)
+
+known = np.count_nonzero(lut != LUT_UNKNOWN)
+print(str(len(points)) + " stickers from " + str(len(scans)) + " scans")
+print(str(known) + " of " + str(lut.size) + " table cells assigned")
+print("Saved " + COLOR_LUT_FILE)
@@ -1,3 +1,7 @@
 class FaceException(Exception):
     def __init__(self, message):
         super().__init__(message)
+
+class AbortException(Exception):
+    def __init__(self, message="Aborted"):
+        super().__init__(message)
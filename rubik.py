@@ -14,14 +14,46 @@ from rubik_servos import RubikServo
 # Cube color scanner class
 from rubik_scan import RubikScan
 
-# This library provieds the moves needed to solve the cube.
-import twophase.solver as solver
+# Cube solver, warmed up in the background
+from rubik_solver import RubikSolver
 
+# Cache of the solutions found earlier
+from rubik_solve_cache import SolutionCache
+
+# Solution to servo primitive compiler
+from rubik_moves import MoveCompiler, predict_time, parse_solution, servo_state
+from rubik_moves import optimize_moves
+
+# Aborting a solve
+from rubik_cancel import CancelToken
+from my_exceptions import AbortException
+
+
+# Number of processes searching for solutions at once, one per CPU core
+# (0 to search in this process only)
+SOLVER_PROCESSES = 4
+
+# Solve search limits
+# The search stops at the first solution with SOLVE_MAX_MOVES moves or
+# fewer, or when no shorter solution turns up for SOLVE_PATIENCE seconds,
+# and after SOLVE_TIMEOUT seconds at the most.
+SOLVE_TIMEOUT = 5
+SOLVE_MAX_MOVES = 20
+SOLVE_PATIENCE = 0.5
+
+# Start loading the solver tables while everything else starts up
+# The solution cache is opened in the main thread, it is used from there.
+solve_cache = SolutionCache()
+solver = RubikSolver(solve_cache, SOLVER_PROCESSES)
+# The search processes are forked before any thread is running
+solver.start_processes()
+solver.start()
 
 # Create the queue used to get button events
 btn_q = Queue(maxsize = 8)
 
 # Create the button class
+button = None
 #button = RubikButtons(btn_q)
 #button.start()
 
@@ -35,18 +67,35 @@ except:
 # Create the cube scanner class
 scanner = RubikScan(servos)
 
+# Create the solution compiler and fill its servo time tables
+compiler = MoveCompiler(servos)
+compiler.prepare()
+
+# Open the camera now, it stays warm between solves
+scanner.camera_init()
+
+# Hand a cancellation token to everything taking part in a solve, None
+# to take it away again
+# A button press cancels the token, the scan, solve or moves then stop
+# within a few tens of milliseconds.
+def set_token(token):
+    if (button is not None):
+        button.token = token
+    servos.token = token
+    scanner.token = token
+
+
 # Solve the cube
 #
 def solve():
     global display
 
-    # Initialize the camera
-    scanner.camera_init()
-
     # Set the grippers to the load cube position
     #servos.cube_load(display, btn_q)
     servos.cube_load(btn_q)
     
+    token = CancelToken()
+    set_token(token)
     try:
         # Read the cube faces to get the current color arrangement
         result = scanner.scan_cube()
@@ -58,12 +107,26 @@ def solve():
             #display.write_body("Scan Error")
             print("Pokazilo sa skenovanie")
             # Wait for a button press
+            set_token(None)
             button_press = btn_q.get()
         else:
             print("Nepokazilo sa skenovanie")
             # Get the moves needed to solve the cube.
-            # Search a full 5 seconds for the best solution.
-            solve_string = solver.solve(cube_string, 100, 5)
+            # Search until a good enough solution turns up, unless this
+            # cube was solved before, and take the one the robot makes
+            # fastest.
+            robot_time = lambda s: predict_time(s, servos, scanner.orient, \
+                                                compiler)[0]
+            # The robot time depends on how the cube lies in the grippers
+            cost_name = "robot time " + str(scanner.orient.key())
+            solve_string, seconds = solver.solve_fastest(cube_string, \
+                                        robot_time, SOLVE_TIMEOUT, \
+                                        max_moves=SOLVE_MAX_MOVES, \
+                                        patience=SOLVE_PATIENCE, \
+                                        token=token, cost_name=cost_name)
+            if (seconds is not None):
+                print(str(len(parse_solution(solve_string))) + \
+                      " moves, %.1f s predicted" % seconds)
             print("toto je solve string:")
             print(solve_string)
             print("toto je cube string:")
@@ -73,16 +136,33 @@ def solve():
 
 
             print(solve_string)
-            #there would be solution mechanism
+            if not solve_string.startswith("Error"):
+                # Make the moves
+                moves = optimize_moves(parse_solution(solve_string))
+                primitives, seconds, end = compiler.compile(moves, \
+                    scanner.orient, servo_state(servos))
+                servos.run_primitives(primitives)
             # Release the cube so it can be removed
             servos.cube_release()
             # Flush any output messages
             sys.stdout.flush()
 
             # Wait for a button press
+            set_token(None)
             button_press = btn_q.get()
-    except KeyboardInterrupt:
+    except (KeyboardInterrupt, AbortException):
+        # Release the cube right away, the servos are left where the
+        # aborted moves were taking them
+        print("Aborted")
         servos.cube_release()
+    finally:
+        set_token(None)
+
+
+# Close the camera and leave
+def quit_robot():
+    scanner.camera.close()
+    quit()
 
 
 # Calibrate the servos
@@ -94,6 +174,10 @@ def calibrate_servos():
 
 
 
+# Report how the solver warm up is doing
+stage, seconds = solver.progress()
+print("Solver " + stage + " (%.1f s)" % seconds)
+
 # Flush any startup output messages
 sys.stdout.flush()
 
@@ -102,7 +186,7 @@ sys.stdout.flush()
 
 # Main menu prompt and function array
 main_menu = [("Solve",solve), \
-             ("Quit", quit), \
+             ("Quit", quit_robot), \
              ("Calibrate", calibrate_servos)]
 main_menu_size = len(main_menu)
 
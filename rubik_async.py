@@ -0,0 +1,100 @@
+# Asyncio interface to the servos
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+
+# Servo class methods that can be queued
+# The primitives, the cube load and release moves and the compiled move
+# runners.
+SERVO_COMMANDS = ("cube_load", "cube_release", "clear_camera",
+                  "right_rotate_cube_90_cw", "right_rotate_cube_90_ccw",
+                  "right_rotate_cube_180",
+                  "right_rotate_face_90_cw", "right_rotate_face_90_ccw",
+                  "right_rotate_face_180",
+                  "left_rotate_cube_90_cw", "left_rotate_cube_90_ccw",
+                  "left_rotate_cube_180",
+                  "left_rotate_face_90_cw", "left_rotate_face_90_ccw",
+                  "left_rotate_face_180",
+                  "run_primitives", "run_moves")
+
+
+# Servo class for asyncio code
+#
+# Every servo command (see SERVO_COMMANDS) is put on a motion queue as
+# soon as it is called and returns an awaitable that is done when the
+# move has settled. The moves run one after the other on a motion
+# thread, with the timing of the servo class, so commands can be queued
+# ahead of time while the event loop goes on with other work such as
+# solving or reporting progress.
+#
+# When a command fails (a cancelled solve aborts a move with an
+# AbortException) the commands queued after it are cancelled, and
+# awaiting them raises asyncio.CancelledError.
+#
+#   robot = AsyncRubikServo(servos)
+#   turn = robot.right_rotate_face_90_cw()
+#   robot.left_rotate_cube_180()
+#   await turn
+#   await robot.idle()
+#
+class AsyncRubikServo(object):
+    def __init__(self, servos):
+        # Servo class that makes the moves
+        self.servos = servos
+        # Motion queue, a single thread runs the commands in order
+        self.executor = ThreadPoolExecutor(max_workers=1, \
+                                           thread_name_prefix="servos")
+        # Commands queued or running
+        self.jobs = []
+        self.lock = threading.Lock()
+
+    def __getattr__(self, name):
+        if (name not in SERVO_COMMANDS):
+            raise AttributeError(name)
+        method = getattr(self.servos, name)
+        return lambda *args: self.submit(method, *args)
+
+    # Queue a call on the motion thread
+    # Returns an asyncio future of the call's result
+    def submit(self, method, *args):
+        loop = asyncio.get_running_loop()
+        with self.lock:
+            job = self.executor.submit(self.run_job, method, args)
+            self.jobs.append(job)
+        job.add_done_callback(self.job_done)
+        return asyncio.wrap_future(job, loop=loop)
+
+    # Run a command, on the motion thread
+    def run_job(self, method, args):
+        try:
+            return method(*args)
+        except BaseException:
+            self.cancel_pending()
+            raise
+
+    def job_done(self, job):
+        with self.lock:
+            if job in self.jobs:
+                self.jobs.remove(job)
+
+    # Number of commands queued or running
+    def pending(self):
+        with self.lock:
+            return len(self.jobs)
+
+    # Cancel the commands that haven't started
+    # The running one, if any, finishes its move.
+    def cancel_pending(self):
+        with self.lock:
+            jobs = list(self.jobs)
+        for job in jobs:
+            job.cancel()
+
+    # Wait for every command queued so far to finish
+    async def idle(self):
+        await self.submit(lambda: None)
+
+    # Stop the motion thread once the queued commands are done
+    def close(self):
+        self.executor.shutdown(wait=False)
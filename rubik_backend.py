@@ -0,0 +1,190 @@
+# Servo hardware backends and clocks
+#
+# The servo class drives a PCA9685 PWM board and waits for the servos on
+# a clock. On the robot these are the real board on the I2C bus and the
+# system clock. For tests and benchmarks off the Pi the simulated board
+# and the virtual clock below take their place: the board records every
+# write and works out where the servos are, and the clock jumps ahead
+# instead of sleeping.
+import struct
+from time import monotonic, sleep
+
+
+# PCA9685 registers
+PCA_MODE1     = 0x00
+PCA_LED0_ON_L = 0x06
+PCA_CHANNELS  = 16
+
+# Speed of the simulated servos (PWM counts per second)
+SIM_SERVO_SPEED = 750
+
+
+# Clock of the real robot
+class SystemClock(object):
+    def monotonic(self):
+        return monotonic()
+
+    # Wait, on the cancellation token when there is one
+    def sleep(self, seconds, token=None):
+        if (token is not None):
+            token.sleep(seconds)
+        elif (seconds > 0):
+            sleep(seconds)
+
+
+# Clock that moves only when something waits on it
+# A wait returns at once, the time just moves on by the wait.
+class VirtualClock(object):
+    def __init__(self, start=0.0):
+        self.now = start
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds, token=None):
+        if (seconds > 0):
+            self.now += seconds
+        if (token is not None):
+            token.check()
+
+
+# PWM board on the robot's I2C bus
+def hardware_pca():
+    # Import I2C pins.
+    import board
+    import busio
+    # Library to control the PCA9685 PWM board that drives the servos
+    from adafruit_pca9685 import PCA9685
+
+    # I2C bus used to communicate with the PWM hardware
+    i2c = busio.I2C(board.SCL, board.SDA)
+    return PCA9685(i2c)
+
+
+# I2C device of the simulated board
+# Takes register writes like the real chip with register auto increment
+# turned on: the first byte selects a register, the rest are written to
+# it and the registers after it.
+class SimI2CDevice(object):
+    def __init__(self, pca):
+        self.pca = pca
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+    def write(self, data):
+        self.pca.write_registers(data[0], data[1:])
+
+
+# Channel of the simulated board, like the adafruit library's channels
+class SimChannel(object):
+    def __init__(self, pca, index):
+        self.pca = pca
+        self.index = index
+
+    @property
+    def duty_cycle(self):
+        return self.pca.channel_pwm(self.index) << 4
+
+    @duty_cycle.setter
+    def duty_cycle(self, value):
+        # The library rounds the 16 bit value to the 12 bit register
+        data = struct.pack("<HH", 0, (value + 1) >> 4)
+        self.pca.i2c_device.write(bytes([PCA_LED0_ON_L + 4 * self.index]) + \
+                                  data)
+
+
+# Simulated PCA9685 PWM board
+#
+# Every PWM value written is recorded with the clock time. Each servo is
+# taken to move towards the last value written to its channel at a
+# fixed speed, so its position at any time follows from the writes.
+#
+class SimPCA9685(object):
+    def __init__(self, clock, speed=SIM_SERVO_SPEED):
+        self.clock = clock
+        # Servo speed (PWM counts per second)
+        self.speed = speed
+        self.frequency = 50
+        self.registers = bytearray(256)
+        # Auto increment on, as the library leaves it
+        self.registers[PCA_MODE1] = 0x20
+        self.i2c_device = SimI2CDevice(self)
+        self.channels = [SimChannel(self, i) for i in range(0, PCA_CHANNELS)]
+        # (time, channel, PWM value) of every value written, and the
+        # number of I2C transfers and bytes
+        self.writes = []
+        self.transfers = 0
+        self.bus_bytes = 0
+
+    # Write registers starting at a register number
+    def write_registers(self, register, data):
+        self.transfers += 1
+        self.bus_bytes += len(data) + 1
+        touched = set()
+        for value in data:
+            self.registers[register] = value
+            if (register >= PCA_LED0_ON_L):
+                channel = (register - PCA_LED0_ON_L) // 4
+                if (channel < PCA_CHANNELS):
+                    touched.add(channel)
+            if (self.registers[PCA_MODE1] & 0x20):
+                register = (register + 1) & 0xFF
+        now = self.clock.monotonic()
+        for channel in sorted(touched):
+            self.writes.append((now, channel, self.channel_pwm(channel)))
+
+    # PWM value (off count) of a channel
+    def channel_pwm(self, channel):
+        base = PCA_LED0_ON_L + 4 * channel
+        return self.registers[base + 2] | (self.registers[base + 3] << 8)
+
+    # Where a servo is at a time
+    #
+    # Inputs:
+    #   channel  PWM channel of the servo
+    #   t        Clock time
+    #
+    # Returns the PWM value the servo has reached, None before the first
+    # value was written to its channel
+    #
+    def position(self, channel, t):
+        pos = None
+        target = None
+        last = None
+        for when, c, pwm in self.writes:
+            if ((c != channel) or (when > t)):
+                continue
+            if (pos is None):
+                # The servo starts where it is first told to be
+                pos = pwm
+            else:
+                pos = self.approach(pos, target, when - last)
+            target = pwm
+            last = when
+        if (pos is None):
+            return None
+        return self.approach(pos, target, t - last)
+
+    # Position after moving towards a target for a time
+    def approach(self, pos, target, seconds):
+        step = self.speed * seconds
+        if (abs(target - pos) <= step):
+            return target
+        return pos + step if (target > pos) else pos - step
+
+    # A servo is still on its way to the last value written
+    def moving(self, channel, t):
+        pos = self.position(channel, t)
+        return (pos is not None) and (pos != self.channel_pwm_at(channel, t))
+
+    # Last PWM value written to a channel up to a time
+    def channel_pwm_at(self, channel, t):
+        pwm = None
+        for when, c, value in self.writes:
+            if ((c == channel) and (when <= t)):
+                pwm = value
+        return pwm
@@ -2,9 +2,6 @@ import threading
 
 from queue import Queue
 
-from GPIO_debounce import GpioDebounce
-from GPIO_debounce import GPIO_PULL_UP, GPIO_PULL_DOWN, GPIO_PULL_OFF
-
 # GPIO pin numbers of the buttons
 # These are processor GPIO numbers, not header pin numbers.
 #
@@ -28,10 +25,18 @@ class RubikButtons(threading.Thread):
         # Save the button queue used to report button presses
         self.out_q = btn_q
 
+        # Cancellation token of the running solve
+        # While it is set the next button press aborts the solve instead
+        # of being reported, so the menu doesn't see it.
+        self.token = None
+
         # Create the queue used to receive GPIO debounce events
         self.in_q = Queue(maxsize = 8)
 
         # Create the GPIO button debounce objects
+        # The GPIO library is only needed once there are buttons, the
+        # button values above can be used without it.
+        from GPIO_debounce import GpioDebounce, GPIO_PULL_UP
         self.pb = GpioDebounce(self.in_q, UP_BUTTON_GPIO, GPIO_PULL_UP, 50)
         self.mb = GpioDebounce(self.in_q, DOWN_BUTTON_GPIO, GPIO_PULL_UP, 50)
         self.eb = GpioDebounce(self.in_q, ENTER_BUTTON_GPIO, GPIO_PULL_UP, 50)
@@ -43,6 +48,10 @@ class RubikButtons(threading.Thread):
 
             # A button press will be a 0 level
             if (button_event[1] == 0):
+                token = self.token
+                if ((token is not None) and not token.cancelled()):
+                    token.cancel()
+                    continue
                 # Determine which button was pressed and report
                 if (button_event[0] == UP_BUTTON_GPIO):
                     self.out_q.put(UP_BUTTON)
@@ -0,0 +1,219 @@
+import os
+import shutil
+from time import sleep, monotonic
+from fractions import Fraction
+
+import numpy as np
+from PIL import Image
+
+
+# The image size for my camera
+IMG_WIDTH = 640
+IMG_HIGHT = 480
+
+# Time for the automatic exposure and white balance to settle after the
+# camera is opened (seconds)
+CAMERA_SETTLE_TIME = 2.0
+
+# Locked exposure and white balance settings file name
+CAMERA_SETTINGS_FILE = "camera_tune.txt"
+
+# Order the scanner captures the faces in
+SCAN_ORDER = (2, 1, 5, 4, 0, 3)
+
+
+# Camera interface used by the cube scanner
+#
+# The camera is opened once and stays open (warm) between solves.
+# lock() fixes the exposure and white balance before the first capture.
+#
+class CameraSession(object):
+    # Open the camera, does nothing if it is already open
+    def open(self):
+        pass
+
+    # Fix the exposure and white balance for the captures
+    # A wait for the settings to settle ends with an AbortException if
+    # the cancellation token given is cancelled.
+    def lock(self, token=None):
+        pass
+
+    # Forget the locked settings, the next lock() measures them again
+    def unlock(self):
+        pass
+
+    # Capture an image
+    #
+    # Inputs:
+    #   output   File name, or a (rows, columns, 3) uint8 array
+    #   format   Image format when capturing into an array ('rgb')
+    #   face     Face in front of the camera, None if not known
+    #   flipped  The face is upside down
+    #   center   Pixel (x, y) of the cube center, the face turns about it
+    #
+    # The face and center are only used by cameras that stand in for the
+    # real one.
+    #
+    def capture(self, output, format=None, face=None, flipped=False, \
+                center=None):
+        raise NotImplementedError
+
+    # Close the camera
+    def close(self):
+        pass
+
+
+# Raspberry Pi camera session
+class PiCameraSession(CameraSession):
+    def __init__(self, settings_file=CAMERA_SETTINGS_FILE):
+        self.settings_file = settings_file
+        self.camera = None
+        self.locked = False
+        self.opened_at = 0.0
+
+    def open(self):
+        if (self.camera is not None):
+            return
+
+        # Raspberry Pi camera library
+        from picamera import PiCamera
+
+        # init camera driver/hardware
+        self.camera = PiCamera()
+        self.camera.resolution = (IMG_WIDTH, IMG_HIGHT)
+        self.camera.start_preview()
+        self.camera.iso = 400
+        self.camera.saturation = 50
+        self.opened_at = monotonic()
+        self.locked = False
+
+        # Reuse the settings locked by an earlier session
+        settings = self.read_settings()
+        if (settings is not None):
+            shutter, red, blue = settings
+            self.camera.exposure_mode = 'off'
+            self.camera.shutter_speed = shutter
+            self.camera.awb_mode = 'off'
+            self.camera.awb_gains = (Fraction(red), Fraction(blue))
+            self.locked = True
+
+    def lock(self, token=None):
+        self.open()
+        if (self.locked):
+            return
+
+        # Let the automatic settings settle, this has usually already
+        # happened while the camera was waiting for the first solve
+        wait = CAMERA_SETTLE_TIME - (monotonic() - self.opened_at)
+        if (token is not None):
+            token.sleep(wait)
+        elif (wait > 0):
+            sleep(wait)
+
+        # Set the camera exposure settings.
+        es = self.camera.exposure_speed
+        self.camera.exposure_mode = 'off'
+        self.camera.shutter_speed = es
+        g = self.camera.awb_gains
+        self.camera.awb_mode = 'off'
+        self.camera.awb_gains = g
+        self.locked = True
+
+        self.write_settings(es, float(g[0]), float(g[1]))
+
+    def unlock(self):
+        if os.path.exists(self.settings_file):
+            os.remove(self.settings_file)
+        if (self.camera is not None):
+            self.camera.exposure_mode = 'auto'
+            self.camera.awb_mode = 'auto'
+            self.opened_at = monotonic()
+        self.locked = False
+
+    def capture(self, output, format=None, face=None, flipped=False, \
+                center=None):
+        self.open()
+        self.camera.capture(output, format)
+
+    def close(self):
+        if (self.camera is not None):
+            self.camera.close()
+            self.camera = None
+
+    # Read the saved shutter speed and white balance gains
+    # Returns None if there are no saved settings.
+    def read_settings(self):
+        if not os.path.exists(self.settings_file):
+            return None
+        try:
+            f = open(self.settings_file, 'r')
+            shutter = int(f.readline().split(" ")[0])
+            red = float(f.readline().split(" ")[0])
+            blue = float(f.readline().split(" ")[0])
+            f.close()
+        except (OSError, ValueError):
+            return None
+        return shutter, red, blue
+
+    def write_settings(self, shutter, red, blue):
+        f = open(self.settings_file, 'w')
+        f.write(str(shutter) + " Shutter speed (us)\n")
+        f.write(str(red) + " White balance red gain\n")
+        f.write(str(blue) + " White balance blue gain\n")
+        f.close()
+
+
+# Camera stand in for machines without the Raspberry Pi camera
+# Each capture returns the stored image of the face in front of the
+# camera, turned about the cube center when the face is upside down.
+# Without the face the next stored image is returned, in the order the
+# scanner captures the faces.
+class FakeCamera(CameraSession):
+    def __init__(self, folder="Cube", order=SCAN_ORDER):
+        self.folder = folder
+        self.order = order
+        self.next_face = 0
+        # Counters to check how the scanner uses the camera
+        self.open_count = 0
+        self.lock_count = 0
+        self.unlock_count = 0
+        self.capture_count = 0
+        self.is_open = False
+
+    def open(self):
+        if not self.is_open:
+            self.is_open = True
+            self.open_count += 1
+
+    def lock(self, token=None):
+        self.open()
+        self.lock_count += 1
+
+    def unlock(self):
+        self.unlock_count += 1
+
+    def capture(self, output, format=None, face=None, flipped=False, \
+                center=None):
+        self.open()
+        if (face is None):
+            face = self.order[self.next_face % len(self.order)]
+            self.next_face += 1
+        self.capture_count += 1
+
+        file = os.path.join(self.folder, "face" + str(face) + ".jpg")
+        if (isinstance(output, str) and not flipped):
+            if (os.path.abspath(output) != os.path.abspath(file)):
+                shutil.copyfile(file, output)
+            return
+        im = Image.open(file)
+        im = im.convert('RGB')
+        if flipped:
+            # Turned about the cube center, the image center if not given
+            im = im.rotate(180, center=center)
+        if isinstance(output, str):
+            im.save(output)
+        else:
+            output[...] = np.asarray(im)
+
+    def close(self):
+        self.is_open = False
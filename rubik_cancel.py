@@ -0,0 +1,46 @@
+import threading
+
+# Exception raised when a cancelled operation stops
+from my_exceptions import AbortException
+
+
+# Seconds between looks at the token while waiting on something that
+# can't be woken up by it
+CANCEL_POLL = 0.02
+
+
+# Cancellation token
+#
+# One token is handed to everything that takes part in a solve (the
+# scanner, the solver and the servos). Cancelling it, from the button
+# thread for example, makes each of them stop at its next check or wait
+# with an AbortException. Waits on the token end as soon as it is
+# cancelled.
+#
+class CancelToken(object):
+    def __init__(self):
+        self.event = threading.Event()
+
+    def cancel(self):
+        self.event.set()
+
+    def cancelled(self):
+        return self.event.is_set()
+
+    # Raise AbortException if cancelled
+    def check(self):
+        if self.event.is_set():
+            raise AbortException()
+
+    # Wait, raising AbortException as soon as the token is cancelled
+    def sleep(self, seconds):
+        if ((seconds > 0) and self.event.wait(seconds)) or \
+           self.event.is_set():
+            raise AbortException()
+
+    # Wait for a thread to finish, raising AbortException if the token is
+    # cancelled first (the thread is left to finish on its own)
+    def join(self, thread):
+        while thread.is_alive():
+            thread.join(CANCEL_POLL)
+            self.check()
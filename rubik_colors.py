@@ -0,0 +1,269 @@
+import os
+import numpy as np
+
+
+# Number of stickers of each color on a cube
+STICKERS_PER_COLOR = 9
+
+# Cost used to keep a center sticker on its own face
+PINNED_COST = 1.0e6
+
+# D65 white point used for the Lab conversion
+WHITE_X = 0.95047
+WHITE_Y = 1.0
+WHITE_Z = 1.08883
+
+
+# Convert RGB colors to CIE Lab
+#
+# Input:
+#   rgb      Array of RGB colors (..., 3), values 0 to 255
+#
+# Returns an array of Lab colors with the same shape
+#
+def rgb_to_lab(rgb):
+    c = np.asarray(rgb, dtype=np.float64) / 255.0
+    # sRGB gamma to linear light
+    c = np.where(c > 0.04045, ((c + 0.055) / 1.055) ** 2.4, c / 12.92)
+
+    x = (c[..., 0] * 0.4124 + c[..., 1] * 0.3576 + c[..., 2] * 0.1805) / WHITE_X
+    y = (c[..., 0] * 0.2126 + c[..., 1] * 0.7152 + c[..., 2] * 0.0722) / WHITE_Y
+    z = (c[..., 0] * 0.0193 + c[..., 1] * 0.1192 + c[..., 2] * 0.9505) / WHITE_Z
+
+    xyz = np.stack((x, y, z), axis=-1)
+    f = np.where(xyz > 0.008856, np.cbrt(xyz), 7.787 * xyz + 16.0 / 116.0)
+
+    lab = np.empty(f.shape)
+    lab[..., 0] = 116.0 * f[..., 1] - 16.0
+    lab[..., 1] = 500.0 * (f[..., 0] - f[..., 1])
+    lab[..., 2] = 200.0 * (f[..., 1] - f[..., 2])
+    return lab
+
+
+# Solve the square assignment problem with the Hungarian method
+#
+# Input:
+#   cost     (n, n) cost matrix, rows are assigned to columns
+#
+# Returns an array with the column assigned to each row, chosen so the
+# total cost is minimal
+#
+def linear_assignment(cost):
+    n = cost.shape[0]
+    # Row and column potentials, index 0 is a dummy column
+    u = np.zeros(n + 1)
+    v = np.zeros(n + 1)
+    # Row matched to each column (0 if none) and the augmenting path
+    p = np.zeros(n + 1, dtype=np.int64)
+    way = np.zeros(n + 1, dtype=np.int64)
+
+    for i in range(1, n + 1):
+        p[0] = i
+        j0 = 0
+        minv = np.full(n + 1, np.inf)
+        used = np.zeros(n + 1, dtype=bool)
+        while 1:
+            used[j0] = True
+            i0 = p[j0]
+            # Reduced cost of every column from the current row
+            cur = np.full(n + 1, np.inf)
+            cur[1:] = cost[i0 - 1] - u[i0] - v[1:]
+            better = ~used & (cur < minv)
+            minv[better] = cur[better]
+            way[better] = j0
+
+            free = np.where(used, np.inf, minv)
+            j1 = int(np.argmin(free))
+            delta = free[j1]
+
+            u[p[used]] += delta
+            v[used] -= delta
+            minv[~used] -= delta
+            j0 = j1
+            if (p[j0] == 0):
+                break
+
+        # Flip the matching along the augmenting path
+        while 1:
+            j1 = way[j0]
+            p[j0] = p[j1]
+            j0 = j1
+            if (j0 == 0):
+                break
+
+    rows = np.empty(n, dtype=np.int64)
+    rows[p[1:] - 1] = np.arange(n)
+    return rows
+
+
+# Distance of every sticker to every center
+#
+# Inputs:
+#   samples  (faces, 9, 3) array of sticker RGB colors
+#   centers  (6, 3) array of center RGB colors
+#   space    Color space the distance is measured in, "rgb" or "lab"
+#
+# Returns a (faces * 9, 6) array of euclidian distances
+#
+def color_distances(samples, centers, space="rgb"):
+    stickers = np.asarray(samples, dtype=np.float64).reshape(-1, 3)
+    centers = np.asarray(centers, dtype=np.float64)
+    if (space == "lab"):
+        stickers = rgb_to_lab(stickers)
+        centers = rgb_to_lab(centers)
+    diff = stickers[:, None, :] - centers[None, :, :]
+    return np.sqrt((diff ** 2).sum(axis=2))
+
+
+# Confidence of a color assignment
+# The margin between the assigned color and the nearest other color,
+# from 0 (could be either color) to 1 (certain).
+#
+# Inputs:
+#   dist     (n, 6) array of sticker to center distances
+#   labels   (n) array of assigned center indexes
+#
+# Returns an (n) array of confidence values
+#
+def color_confidence(dist, labels):
+    index = np.arange(len(labels))
+    d_assigned = dist[index, labels]
+    others = dist.copy()
+    others[index, labels] = np.inf
+    d_other = others.min(axis=1)
+    confidence = (d_other - d_assigned) / np.maximum(d_other + d_assigned, 1e-9)
+    return np.clip(confidence, 0.0, 1.0)
+
+
+# Assign all stickers to colors at once with exactly 9 of each color
+#
+# Inputs:
+#   samples  (6, 9, 3) array of sticker RGB colors
+#   centers  (6, 3) array of center RGB colors in U, R, F, D, L, B order
+#   space    Color space the distance is measured in, "rgb" or "lab"
+#
+# Returns a (6, 9) array of center indexes and a (6, 9) array of
+# confidence values from 0 (could be either color) to 1 (certain)
+#
+def assign_colors(samples, centers, space="rgb"):
+    faces = samples.shape[0]
+
+    # Distance of every sticker to every center (54, 6)
+    dist = color_distances(samples, centers, space)
+
+    # Each center sticker stays on its own face
+    cost = dist.copy()
+    for face in range(0, faces):
+        center = face * 9 + 4
+        cost[center, :] = PINNED_COST
+        cost[center, face] = 0.0
+
+    # One column per sticker slot, 9 slots for every color
+    slots = np.repeat(cost, STICKERS_PER_COLOR, axis=1)
+    labels = linear_assignment(slots) // STICKERS_PER_COLOR
+
+    confidence = color_confidence(dist, labels)
+    return labels.reshape(faces, 9), confidence.reshape(faces, 9)
+
+
+# Size of the color lookup table along each RGB axis
+LUT_SIZE = 32
+
+# Lookup table entry for colors outside every color's confidence region
+LUT_UNKNOWN = 255
+
+
+# Group colors into clusters with k-means
+#
+# Inputs:
+#   points      (n, 3) array of RGB colors
+#   means       (k, 3) array of starting cluster colors
+#   iterations  Maximum number of refinement passes
+#
+# Returns the (k, 3) cluster colors and the cluster of each point
+#
+def kmeans(points, means, iterations=20):
+    means = np.array(means, dtype=np.float64)
+    labels = np.zeros(len(points), dtype=np.int64)
+    for i in range(0, iterations):
+        labels = color_distances(points, means).argmin(axis=1)
+        new_means = means.copy()
+        for k in range(0, len(means)):
+            if (np.any(labels == k)):
+                new_means[k] = points[labels == k].mean(axis=0)
+        if (np.allclose(new_means, means)):
+            break
+        means = new_means
+    return means, labels
+
+
+# Build a quantized RGB to color lookup table
+#
+# Inputs:
+#   points          (n, 3) array of sticker colors from earlier scans
+#   means           (6, 3) array of starting colors, one per cube color
+#   size            Number of table cells along each RGB axis
+#   radius_scale    How far past the farthest sample of a color the
+#                   color's region reaches
+#   min_confidence  Smallest margin to the nearest other color
+#
+# Returns a (size, size, size) uint8 table of color numbers, or
+# LUT_UNKNOWN where a color can't be trusted
+#
+def build_lut(points, means, size=LUT_SIZE, radius_scale=1.5, \
+              min_confidence=0.2):
+    points = np.asarray(points, dtype=np.float64).reshape(-1, 3)
+    means, labels = kmeans(points, means)
+
+    # Region of each color around its cluster
+    dist = color_distances(points, means)
+    radius = np.zeros(len(means))
+    for k in range(0, len(means)):
+        if (np.any(labels == k)):
+            radius[k] = dist[labels == k, k].max() * radius_scale
+
+    # RGB color at the middle of every table cell
+    step = 256.0 / size
+    axis = (np.arange(size) + 0.5) * step
+    cells = np.stack(np.meshgrid(axis, axis, axis, indexing='ij'), axis=-1)
+
+    cell_dist = color_distances(cells, means)
+    cell_color = cell_dist.argmin(axis=1)
+    inside = cell_dist[np.arange(len(cell_color)), cell_color] \
+             <= radius[cell_color]
+    sure = color_confidence(cell_dist, cell_color) >= min_confidence
+
+    lut = np.where(inside & sure, cell_color, LUT_UNKNOWN)
+    return lut.astype(np.uint8).reshape(size, size, size)
+
+
+# Save a lookup table as a raw binary file
+def save_lut(lut, file):
+    np.ascontiguousarray(lut, dtype=np.uint8).tofile(file)
+
+
+# Memory map a lookup table file
+# Returns None if the file doesn't hold a table of the size given, a
+# truncated or stale table would give wrong colors.
+def load_lut(file, size=LUT_SIZE):
+    if (os.path.getsize(file) != size ** 3):
+        print("Ignoring " + file + ", it isn't a " + str(size) + \
+              " cubed color table")
+        return None
+    return np.memmap(file, dtype=np.uint8, mode='r', shape=(size, size, size))
+
+
+# Look up the color number of every sticker
+#
+# Inputs:
+#   lut      (size, size, size) lookup table
+#   samples  (..., 3) array of sticker RGB colors
+#
+# Returns an array of color numbers, LUT_UNKNOWN where the table
+# doesn't know the color
+#
+def lut_lookup(lut, samples):
+    size = lut.shape[0]
+    cell = (np.asarray(samples) * (size / 256.0)).astype(np.int64)
+    cell = np.clip(cell, 0, size - 1)
+    return lut[cell[..., 0], cell[..., 1], cell[..., 2]]
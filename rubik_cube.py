@@ -0,0 +1,275 @@
+# Facelet level cube model
+#
+# The cube definition string lists the 54 facelets face by face in
+# U, R, F, D, L, B order, each face row by row as the solver draws it.
+# Every facelet is placed in 3D (x right, y up, z front) so moves and
+# whole cube rotations are plain rotations of the facelet positions.
+
+
+# Face letters in cube string order
+FACE_NAMES = "URFDLB"
+
+# Normal, right and down direction of each face as drawn in the string
+FACE_AXES = {"U": (( 0,  1,  0), ( 1,  0,  0), ( 0,  0,  1)),
+             "R": (( 1,  0,  0), ( 0,  0, -1), ( 0, -1,  0)),
+             "F": (( 0,  0,  1), ( 1,  0,  0), ( 0, -1,  0)),
+             "D": (( 0, -1,  0), ( 1,  0,  0), ( 0,  0, -1)),
+             "L": ((-1,  0,  0), ( 0,  0,  1), ( 0, -1,  0)),
+             "B": (( 0,  0, -1), (-1,  0,  0), ( 0, -1,  0))}
+
+SOLVED = "".join(face * 9 for face in FACE_NAMES)
+
+
+# Position (cubie, normal) of every facelet
+def facelet_positions():
+    positions = []
+    for face in FACE_NAMES:
+        n, r, d = FACE_AXES[face]
+        for row in range(0, 3):
+            for col in range(0, 3):
+                cubie = tuple(n[k] + (col - 1) * r[k] + (row - 1) * d[k] \
+                              for k in range(0, 3))
+                positions.append((cubie, n))
+    return positions
+
+FACELETS = facelet_positions()
+FACELET_INDEX = {pos: i for i, pos in enumerate(FACELETS)}
+
+# Face letter of each normal
+NORMAL_FACE = {FACE_AXES[face][0]: face for face in FACE_NAMES}
+
+
+# Turn a vector clockwise (seen from the tip of the axis) a number of
+# quarter turns
+def turn_vector(v, axis, quarters):
+    for i in range(0, quarters % 4):
+        cross = (axis[1] * v[2] - axis[2] * v[1],
+                 axis[2] * v[0] - axis[0] * v[2],
+                 axis[0] * v[1] - axis[1] * v[0])
+        dot = axis[0] * v[0] + axis[1] * v[1] + axis[2] * v[2]
+        v = (axis[0] * dot - cross[0],
+             axis[1] * dot - cross[1],
+             axis[2] * dot - cross[2])
+    return v
+
+
+# Facelet permutation of a turn
+#
+# Inputs:
+#   axis      Axis of the turn (a face normal)
+#   quarters  Clockwise quarter turns seen from the tip of the axis
+#   layer     True to turn only the layer at the tip of the axis, False
+#             to turn the whole cube
+#
+# Returns a list giving the new index of every facelet
+#
+def turn_permutation(axis, quarters, layer=True):
+    perm = []
+    for cubie, n in FACELETS:
+        on_layer = sum(cubie[k] * axis[k] for k in range(0, 3)) == 1
+        if (on_layer or not layer):
+            cubie = turn_vector(cubie, axis, quarters)
+            n = turn_vector(n, axis, quarters)
+        perm.append(FACELET_INDEX[(cubie, n)])
+    return perm
+
+# Facelet permutation of every face turn, by face and quarter turns
+MOVE_PERMS = {(face, q): turn_permutation(FACE_AXES[face][0], q)
+              for face in FACE_NAMES for q in (1, 2, 3)}
+
+
+# Apply moves to a cube
+#
+# Inputs:
+#   cube_string  54 character cube definition string
+#   moves        List of (face letter, clockwise quarter turns) tuples
+#
+# Returns the cube definition string after the moves
+#
+def apply_moves(cube_string, moves):
+    cube = list(cube_string)
+    for move in moves:
+        perm = MOVE_PERMS[move]
+        new = [None] * 54
+        for i in range(0, 54):
+            new[perm[i]] = cube[i]
+        cube = new
+    return "".join(cube)
+
+
+# Whole cube rotations
+# Each rotation is stored as the face letter every face is moved to.
+# All 24 are found by combining quarter turns about the x, y and z axes.
+def cube_rotations():
+    start = tuple(FACE_NAMES)
+    found = [start]
+    frontier = [start]
+    while frontier:
+        nxt = []
+        for faces in frontier:
+            for axis in ((1, 0, 0), (0, 1, 0), (0, 0, 1)):
+                moved = tuple(NORMAL_FACE[turn_vector(FACE_AXES[f][0], axis, 1)]
+                              for f in faces)
+                if moved not in found:
+                    found.append(moved)
+                    nxt.append(moved)
+        frontier = nxt
+    return [dict(zip(FACE_NAMES, faces)) for faces in found]
+
+# The 24 rotations, the first one is no rotation
+ROTATIONS = cube_rotations()
+
+
+# Facelet permutation of a whole cube rotation
+def rotation_permutation(rotation):
+    perm = []
+    for cubie, n in FACELETS:
+        # The rotation is linear, find where each basis vector goes
+        new_cubie = [0, 0, 0]
+        new_n = [0, 0, 0]
+        for face in FACE_NAMES:
+            a = FACE_AXES[face][0]
+            b = FACE_AXES[rotation[face]][0]
+            # Only the positive axes are needed for a linear map
+            if (sum(a) != 1):
+                continue
+            ck = sum(cubie[k] * a[k] for k in range(0, 3))
+            nk = sum(n[k] * a[k] for k in range(0, 3))
+            for k in range(0, 3):
+                new_cubie[k] += ck * b[k]
+                new_n[k] += nk * b[k]
+        perm.append(FACELET_INDEX[(tuple(new_cubie), tuple(new_n))])
+    return perm
+
+
+# Look at a cube after a whole cube rotation
+# The facelets move with the cube and every facelet gets the letter of
+# the face its color's center has moved to, so the result is a normal
+# cube definition string.
+#
+# Inputs:
+#   cube_string  54 character cube definition string
+#   rotation     One of ROTATIONS
+#
+# Returns the rotated cube definition string
+#
+def rotate_cube(cube_string, rotation):
+    perm = rotation_permutation(rotation)
+    new = [None] * 54
+    for i in range(0, 54):
+        new[perm[i]] = rotation[cube_string[i]]
+    return "".join(new)
+
+
+# Map moves found on a rotated cube back to the unrotated cube
+def unrotate_moves(moves, rotation):
+    back = {new: old for old, new in rotation.items()}
+    return [(back[face], turns) for face, turns in moves]
+
+
+# Facelet indices of every cubie, by cubie position
+def cubie_facelets():
+    cubies = {}
+    for i, (cubie, n) in enumerate(FACELETS):
+        cubies.setdefault(cubie, []).append(i)
+    return cubies
+
+CUBIES = cubie_facelets()
+
+
+# Sign of a permutation given as a list, 1 for even and -1 for odd
+def permutation_sign(perm):
+    sign = 1
+    seen = [False] * len(perm)
+    for start in range(0, len(perm)):
+        if seen[start]:
+            continue
+        # A cycle of even length is an odd permutation
+        length = 0
+        i = start
+        while not seen[i]:
+            seen[i] = True
+            i = perm[i]
+            length += 1
+        if (length % 2 == 0):
+            sign = -sign
+    return sign
+
+
+# Colors of a corner, starting on the U or D face and going round the
+# corner in the same direction at every corner
+def corner_colors(cube_string, cubie):
+    x, y, z = cubie
+    axes = [(0, y, 0), (x, 0, 0), (0, 0, z)]
+    if (x * y * z > 0):
+        axes = [axes[0], axes[2], axes[1]]
+    return [cube_string[FACELET_INDEX[(cubie, n)]] for n in axes]
+
+
+# Check a cube definition string is a cube that can be solved
+# Every corner and edge must be a real cubie that appears once, the
+# corner twists and edge flips must add up and the corner and edge
+# permutations must have the same parity, as on a cube that was only
+# ever turned.
+#
+# Input:
+#   cube_string  54 character cube definition string
+#
+# Returns True for a solvable cube
+#
+def cube_is_valid(cube_string):
+    if ((len(cube_string) != 54) or \
+        any(cube_string[i * 9 + 4] != FACE_NAMES[i] for i in range(0, 6))):
+        return False
+
+    # Cubie position of every set of colors in the solved cube
+    home = {frozenset(SOLVED[i] for i in idx): cubie \
+            for cubie, idx in CUBIES.items() if (len(idx) > 1)}
+    positions = {2: [], 3: []}
+    held = {2: [], 3: []}
+    twist = 0
+    flip = 0
+    for cubie, idx in CUBIES.items():
+        if (len(idx) == 1):
+            continue
+        key = frozenset(cube_string[i] for i in idx)
+        if ((len(key) != len(idx)) or (key not in home)):
+            return False
+        positions[len(idx)].append(cubie)
+        held[len(idx)].append(home[key])
+        if (len(idx) == 3):
+            # The twist is where the U or D color is, and the colors must
+            # follow each other as on the real corner
+            colors = corner_colors(cube_string, cubie)
+            turn = [c in "UD" for c in colors].index(True)
+            if (colors[turn:] + colors[:turn] != \
+                corner_colors(SOLVED, home[key])):
+                return False
+            twist += turn
+        else:
+            # An edge is flipped when its U or D color (F or B color for
+            # the middle layer edges) isn't on the U or D face (F or B
+            # face for the middle layer positions)
+            colors = {FACELETS[i][1]: cube_string[i] for i in idx}
+            ref = [c for c in colors.values() if (c in "UD")] or \
+                  [c for c in colors.values() if (c in "FB")]
+            axis = 1 if (cubie[1] != 0) else 2
+            on_axis = [c for n, c in colors.items() if (n[axis] != 0)][0]
+            flip += (on_axis != ref[0])
+
+    if ((twist % 3 != 0) or (flip % 2 != 0)):
+        return False
+    for size in (2, 3):
+        if (len(set(held[size])) != len(held[size])):
+            return False
+    sign = 1
+    for size in (2, 3):
+        perm = [positions[size].index(c) for c in held[size]]
+        sign *= permutation_sign(perm)
+    return sign == 1
+
+
+# Write moves in the solver's notation, for example "R1 U2 F3 (3f)"
+def format_moves(moves):
+    text = " ".join(face + str(turns) for face, turns in moves)
+    return text + " (" + str(len(moves)) + "f)"
@@ -0,0 +1,201 @@
+import os
+import numpy as np
+
+
+# Sticker pixel detection
+# Stickers are bright and strongly colored, the cube body and the
+# background are dark.
+STICKER_MIN_VALUE = 90         # Minimum brightest channel value
+STICKER_MIN_CHROMA = 60        # Minimum spread between channels
+
+# Range of sticker spacing searched (pixels of the full size image)
+MIN_PITCH = 60
+MAX_PITCH = 200
+
+# The image is searched at a reduced size to save time
+SEARCH_SCALE = 4
+
+# Fraction of sticker pixels every square of a lattice must have
+MIN_FILL = 0.9
+
+# Most sticker pixels the seams between the stickers of a lattice may
+# have, the seams are darker than the stickers
+MAX_SEAM_FILL = 0.9
+
+
+# Find the pixels that look like sticker pixels
+#
+# Input:
+#   pixels   RGB pixel array of a face (rows, columns, 3)
+#
+# Returns a float array of the same size, 1 for sticker pixels
+#
+def sticker_mask(pixels):
+    p = pixels.astype(np.int16)
+    hi = p.max(axis=2)
+    lo = p.min(axis=2)
+    mask = (hi >= STICKER_MIN_VALUE) & ((hi - lo) >= STICKER_MIN_CHROMA)
+    return mask.astype(np.float64)
+
+
+# Sum of every box of a given size, for every top left corner
+#
+# Inputs:
+#   integral  Summed area table with a leading row and column of zeros
+#   size      Box width and height
+#
+# Returns an array of box sums, one per box position
+#
+def box_sums(integral, size):
+    return integral[size:, size:] - integral[:-size, size:] \
+           - integral[size:, :-size] + integral[:-size, :-size]
+
+
+# Fill of a line of pixels for every lattice position
+#
+# Inputs:
+#   integral  Running sum of the mask along the line direction, with a
+#             leading row of zeros (axis 0 runs along the line)
+#   start     Offset of the line start from the lattice corner, along
+#   across    Offset of the line from the lattice corner, across
+#   length    Line length
+#   h, w      Number of lattice positions along and across
+#
+# Returns an (h, w) array of line fills
+#
+def line_fills(integral, start, across, length, h, w):
+    return (integral[start + length:start + length + h, across:across + w] - \
+            integral[start:start + h, across:across + w]) / length
+
+
+# Find the 3x3 sticker lattice in a face image
+#
+# Every sticker spacing in range is tried at every position. The colors
+# bleed over the thin gaps between the stickers, but the seams are still
+# a little darker than the stickers. Of the lattices whose 9 sticker
+# squares are all filled with sticker pixels, the one whose 4 inner
+# seams all have the fewest sticker pixels is taken. Taking the largest
+# filled lattice instead would reach past the face when something
+# strongly colored, like the blue cube holder, is next to it.
+#
+# Input:
+#   pixels   RGB pixel array of a face (rows, columns, 3)
+#
+# Returns the 9 sticker centers as a list of (x, y) tuples in row
+# order, or None if no lattice was found
+#
+def detect_grid(pixels):
+    mask = sticker_mask(pixels)
+
+    # Shrink the mask to speed up the search
+    s = SEARCH_SCALE
+    rows = (mask.shape[0] // s) * s
+    cols = (mask.shape[1] // s) * s
+    small = mask[:rows, :cols].reshape(rows // s, s, cols // s, s).mean(axis=(1, 3))
+    integral = np.zeros((small.shape[0] + 1, small.shape[1] + 1))
+    integral[1:, 1:] = small.cumsum(axis=0).cumsum(axis=1)
+    # Running sums down the columns and along the rows
+    down = np.zeros((small.shape[0] + 1, small.shape[1]))
+    down[1:] = small.cumsum(axis=0)
+    along = np.zeros((small.shape[1] + 1, small.shape[0]))
+    along[1:] = small.T.cumsum(axis=0)
+
+    best = None
+    for pitch in range(MIN_PITCH // s, MAX_PITCH // s + 1):
+        # Size of a sticker square
+        st = max(1, int(pitch * 0.6))
+        sums = box_sums(integral, st) / (st * st)
+
+        # Lattice positions where the whole lattice fits in the image
+        span = 2 * pitch + st
+        h = small.shape[0] - span + 1
+        w = small.shape[1] - span + 1
+        if ((h <= 0) or (w <= 0)):
+            break
+
+        # Fill of the emptiest of the 9 sticker squares
+        fill = np.ones((h, w))
+        for r in range(0, 3):
+            for c in range(0, 3):
+                y = r * pitch
+                x = c * pitch
+                fill = np.minimum(fill, sums[y:y + h, x:x + w])
+
+        # Fill of the brightest seam between the rows and between the
+        # columns, each running from the first sticker center to the last
+        # Every seam must be dark, a lattice with half the real spacing
+        # only finds some of them.
+        mid = st // 2
+        seam = (pitch + st) // 2
+        seams = np.zeros((h, w))
+        for k in range(0, 2):
+            seams = np.maximum(seams, line_fills(down, mid, seam + k * pitch, \
+                                                 2 * pitch, h, w))
+            seams = np.maximum(seams, line_fills(along, mid, \
+                                                 seam + k * pitch, \
+                                                 2 * pitch, w, h).T)
+        seams[fill < MIN_FILL] = np.inf
+
+        pos = np.unravel_index(np.argmin(seams), seams.shape)
+        if ((seams[pos] <= MAX_SEAM_FILL) and \
+            ((best is None) or (seams[pos] < best[0]))):
+            best = (seams[pos], pos[0], pos[1], pitch, st)
+
+    if (best is None):
+        return None
+
+    # Lattice centers in full size pixels
+    seam_fill, y0, x0, pitch, st = best
+    locs = []
+    for r in range(0, 3):
+        for c in range(0, 3):
+            locs.append((int((x0 + c * pitch) * s + (st * s) // 2), \
+                         int((y0 + r * pitch) * s + (st * s) // 2)))
+    return locs
+
+
+# Find the sticker lattice in several face images
+# The median of all faces with a lattice is used.
+#
+# Input:
+#   faces    List of RGB pixel arrays
+#
+# Returns the 9 sticker centers, or None if no face had a lattice
+#
+def detect_grid_faces(faces):
+    found = []
+    for pixels in faces:
+        locs = detect_grid(pixels)
+        if (locs is not None):
+            found.append(locs)
+    if (len(found) == 0):
+        return None
+    med = np.median(np.array(found), axis=0)
+    return [(int(round(x)), int(round(y))) for x, y in med]
+
+
+# Read the cached sticker centers
+# Returns None if there is no usable cache file.
+def load_grid(file):
+    if not os.path.exists(file):
+        return None
+    locs = []
+    try:
+        f = open(file, 'r')
+        for line in f:
+            x, y = line.split()[:2]
+            locs.append((int(x), int(y)))
+        f.close()
+    except (OSError, ValueError):
+        return None
+    if (len(locs) != 9):
+        return None
+    return locs
+
+
+# Save the sticker centers to the cache file
+def save_grid(file, locs):
+    f = open(file, 'w')
+    for x, y in locs:
+        f.write(str(x) + " " + str(y) + "\n")
+    f.close()
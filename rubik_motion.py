@@ -0,0 +1,142 @@
+from itertools import permutations
+
+# Servo moves and what they do to the cube
+from rubik_transitions import move_effect, holds_cube
+
+
+# Number of groups a move can be moved ahead by
+SCHEDULE_WINDOW = 4
+
+
+# Servo state after a move
+def apply_move(state, servo, pos):
+    nxt = list(state)
+    nxt[servo] = pos
+    return tuple(nxt)
+
+
+# Effects of servo moves made at the same time
+# Moves made together can finish in any order, so every order has to be
+# allowed, keep the cube held and give the same effects. At most one of
+# them may change the cube.
+#
+# Inputs:
+#   state    Servo state before the moves
+#   moves    List of (servo, position) moves, on different servos
+#
+# Returns the effect of each move, or None if the moves can't be made
+# together
+#
+def group_effects(state, moves):
+    effects = None
+    for order in permutations(range(0, len(moves))):
+        s = state
+        found = [None] * len(moves)
+        for i in order:
+            servo, pos = moves[i]
+            if (s[servo] == pos):
+                return None
+            effect = move_effect(s, servo, pos)
+            nxt = apply_move(s, servo, pos)
+            if ((effect is False) or (holds_cube(nxt) != holds_cube(s))):
+                return None
+            found[i] = effect
+            s = nxt
+        if (effects is None):
+            effects = found
+            if (sum(1 for e in effects if e is not None) > 1):
+                return None
+        elif (found != effects):
+            return None
+    return effects
+
+
+# Group servo moves so independent ones run at the same time
+#
+# The moves are taken in order. Each move goes into the earliest group
+# in the window that it doesn't depend on, that is where it can run
+# alongside the group's moves and ahead of everything after them
+# without changing what happens to the cube: the effects happen in the
+# same order, the cube stays held and the servos end up in the same
+# positions. Otherwise it starts a new group.
+#
+# Inputs:
+#   state    Servo state at the start
+#   moves    List of (servo, position) moves, in the order they would be
+#            made one at a time
+#
+# Returns a list of groups, each a list of (servo, position) moves
+#
+def schedule_moves(state, moves):
+    # Effect of every move made one at a time and the state after it
+    expected = []
+    after = []
+    s = state
+    for servo, pos in moves:
+        expected.append(move_effect(s, servo, pos))
+        s = apply_move(s, servo, pos)
+        after.append(s)
+
+    # Groups of move numbers and the servo state before each group
+    groups = []
+    starts = []
+    for m in range(0, len(moves)):
+        placed = False
+        for g in range(max(0, len(groups) - SCHEDULE_WINDOW), len(groups)):
+            trial = [groups[g] + [m]] + groups[g + 1:]
+            if check_groups(starts[g], trial, moves, expected, after[m]):
+                groups = groups[:g] + trial
+                placed = True
+                break
+        if not placed:
+            if groups:
+                s = starts[-1]
+                for i in groups[-1]:
+                    s = apply_move(s, moves[i][0], moves[i][1])
+            else:
+                s = state
+            starts.append(s)
+            groups.append([m])
+        else:
+            # The groups after the changed one start from new states
+            for h in range(g + 1, len(groups)):
+                s = starts[h - 1]
+                for i in groups[h - 1]:
+                    s = apply_move(s, moves[i][0], moves[i][1])
+                starts[h] = s
+
+    return [[moves[i] for i in group] for group in groups]
+
+
+# Check that groups of moves do what the moves do one at a time
+#
+# Inputs:
+#   state     Servo state before the first group
+#   groups    Groups of move numbers
+#   moves     All the (servo, position) moves
+#   expected  Effect of every move made one at a time
+#   end       Servo state the groups have to end in
+#
+# Returns True if the groups can run
+#
+def check_groups(state, groups, moves, expected, end):
+    s = state
+    last_effect = -1
+    for group in groups:
+        servos = [moves[i][0] for i in group]
+        if (len(set(servos)) != len(servos)):
+            return False
+        effects = group_effects(s, [moves[i] for i in group])
+        if (effects is None):
+            return False
+        for i, effect in zip(group, effects):
+            if (effect != expected[i]):
+                return False
+            if (effect is not None):
+                # Changes to the cube stay in order
+                if (i < last_effect):
+                    return False
+                last_effect = i
+        for i in group:
+            s = apply_move(s, moves[i][0], moves[i][1])
+    return s == end
@@ -0,0 +1,311 @@
+# Cube moves and the servo primitives that make them
+import heapq
+
+from rubik_orient import CubeOrientation, CUBE_ROTATIONS, FACE_NAMES
+from rubik_orient import POS_RIGHT, POS_LEFT
+
+
+# Face turn primitives of each gripper, by number of clockwise quarter
+# turns (1, 2, 3) of the face the gripper holds, seen from that face.
+# The left gripper turns are named as seen from the camera, which is the
+# other way round.
+FACE_TURNS = {POS_RIGHT: (None,
+                          "right_rotate_face_90_cw",
+                          "right_rotate_face_180",
+                          "right_rotate_face_90_ccw"),
+              POS_LEFT:  (None,
+                          "left_rotate_face_90_ccw",
+                          "left_rotate_face_180",
+                          "left_rotate_face_90_cw")}
+
+
+# Face on the opposite side of each face
+# Turns of opposite faces don't affect each other, they commute.
+OPPOSITE_FACE = {"U": "D", "D": "U", "R": "L", "L": "R", "F": "B", "B": "F"}
+
+
+# Read the moves of a solution string
+#
+# Input:
+#   solve_string  Solver output, for example "R1 U2 F3 (3f)"
+#
+# Returns a list of (face letter, clockwise quarter turns) tuples
+#
+def parse_solution(solve_string):
+    moves = []
+    for token in solve_string.split():
+        if ((len(token) == 2) and (token[0] in "URFDLB") and \
+            (token[1] in "123")):
+            moves.append((token[0], int(token[1])))
+    return moves
+
+
+# Cancel and merge moves
+# A move is merged with the last move on the same face when only a
+# move on the opposite face is in between, "R1 R1" becomes "R2",
+# "U1 U3" goes away and "R1 L1 R1" becomes "R2 L1". Merging again after
+# a move goes away catches cancellations that uncover others.
+#
+# Input:
+#   moves    List of (face letter, quarter turns) tuples
+#
+# Returns the shorter list of moves, which does the same to the cube
+#
+def optimize_moves(moves):
+    result = []
+    for face, turns in moves:
+        i = len(result) - 1
+        if ((i >= 0) and (result[i][0] == OPPOSITE_FACE[face])):
+            i -= 1
+        if ((i >= 0) and (result[i][0] == face)):
+            turns = (result[i][1] + turns) % 4
+            if (turns == 0):
+                del result[i]
+            else:
+                result[i] = (face, turns)
+        elif (turns % 4 != 0):
+            result.append((face, turns % 4))
+    return result
+
+
+# Servo state of the servo class, as compiled from
+# (right turn, right grip, left turn, left grip) positions
+def servo_state(servos):
+    return (servos.rt_pos, servos.rg_pos, servos.lt_pos, servos.lg_pos)
+
+
+# Solution compiler
+#
+# Turns a list of moves into servo primitives. For every move it picks
+# the gripper that turns the face and the cube rotations that bring the
+# face there, so the whole solution takes the least servo time. The
+# servo time of every primitive depends on where the servos start, it
+# is taken from the servo timing model once and kept.
+#
+# A solution is compiled one move at a time keeping the best way to
+# reach every cube orientation the move can be made in (8 of them).
+# Orientations and servo states are numbered so the tables are quick to
+# look up, a 20 move solution takes a fraction of a millisecond once the
+# tables are filled.
+#
+class MoveCompiler(object):
+    def __init__(self, servos=None):
+        # Needs the servo class, which needs the servo hardware libraries
+        from rubik_servos import ServoTimeModel
+        self.model = ServoTimeModel(servos)
+        # Servo states by number, and the numbers
+        self.states = []
+        self.state_ids = {}
+        # Servo state with both grippers holding the cube
+        self.start = self.state_id(servo_state(self.model))
+        # Primitive time and servo state after, by (primitive, state)
+        self.times = {}
+        # Cheapest rotations from an orientation and servo state
+        self.sources = {}
+        # Ways to make a move, by (orientation, state, face, turns)
+        self.options = {}
+
+        # Orientation keys by number, and the numbers
+        self.keys = []
+        self.key_ids = {}
+        # Orientation after every cube rotation, by (orientation, rotation)
+        self.turned = {}
+        # Orientations each face can be turned in, with the position
+        self.targets = {face: [] for face in FACE_NAMES}
+        todo = [CubeOrientation()]
+        self.key_id(todo[0].key())
+        while todo:
+            orient = todo.pop()
+            k = self.key_ids[orient.key()]
+            for face, position in orient.pos.items():
+                if (position in FACE_TURNS):
+                    self.targets[face].append((k, position))
+            for rotation in CUBE_ROTATIONS:
+                nxt = orient.copy()
+                nxt.apply(rotation)
+                if (nxt.key() not in self.key_ids):
+                    todo.append(nxt)
+                self.turned[(k, rotation)] = self.key_id(nxt.key())
+
+    # Number of an orientation key
+    def key_id(self, key):
+        if (key not in self.key_ids):
+            self.key_ids[key] = len(self.keys)
+            self.keys.append(key)
+        return self.key_ids[key]
+
+    # Number of a servo state
+    def state_id(self, state):
+        if (state not in self.state_ids):
+            self.state_ids[state] = len(self.states)
+            self.states.append(state)
+        return self.state_ids[state]
+
+    # Servo time and servo state after a primitive
+    def step(self, primitive, s):
+        found = self.times.get((primitive, s))
+        if (found is None):
+            model = self.model
+            model.rt_pos, model.rg_pos, model.lt_pos, model.lg_pos = \
+                self.states[s]
+            model.elapsed = 0.0
+            seconds = model.run([primitive])
+            found = (seconds, self.state_id(servo_state(model)))
+            self.times[(primitive, s)] = found
+        return found
+
+    # Cheapest rotations to every orientation and servo state
+    # Returns {(orientation, state): (seconds, previous, rotation)}
+    def reach(self, k, s):
+        found = self.sources.get((k, s))
+        if (found is None):
+            found = {(k, s): (0.0, None, None)}
+            heap = [(0.0, k, s)]
+            done = set()
+            while heap:
+                seconds, k1, s1 = heapq.heappop(heap)
+                if ((k1, s1) in done):
+                    continue
+                done.add((k1, s1))
+                for rotation in CUBE_ROTATIONS:
+                    step_time, s2 = self.step(rotation, s1)
+                    node = (self.turned[(k1, rotation)], s2)
+                    t = seconds + step_time
+                    if ((node not in found) or (t < found[node][0])):
+                        found[node] = (t, (k1, s1), rotation)
+                        heapq.heappush(heap, (t, node[0], s2))
+            self.sources[(k, s)] = found
+        return found
+
+    # Cheapest ways to make a move from an orientation and servo state
+    # Returns a list of (orientation the face is turned in, seconds,
+    # servo state after, primitives), one for each orientation
+    def moves(self, k, s, face, turns):
+        found = self.options.get((k, s, face, turns))
+        if (found is None):
+            reached = self.reach(k, s)
+            found = []
+            for target, position in self.targets[face]:
+                turn = FACE_TURNS[position][turns]
+                best = None
+                for node, (seconds, prev, rotation) in reached.items():
+                    if (node[0] != target):
+                        continue
+                    turn_time, after = self.step(turn, node[1])
+                    if ((best is None) or (seconds + turn_time < best[0])):
+                        best = (seconds + turn_time, after, node)
+                primitives = [turn]
+                node = best[2]
+                while (reached[node][1] is not None):
+                    primitives.insert(0, reached[node][2])
+                    node = reached[node][1]
+                found.append((target, best[0], best[1], primitives))
+            self.options[(k, s, face, turns)] = found
+        return found
+
+    # Fill the tables for every orientation and servo state the robot
+    # can be in between moves, so no solution has to wait for them
+    def prepare(self):
+        states = [self.start]
+        i = 0
+        while (i < len(states)):
+            for k in range(0, len(self.keys)):
+                for face in FACE_NAMES:
+                    for turns in (1, 2, 3):
+                        for target, t, after, primitives in \
+                                self.moves(k, states[i], face, turns):
+                            if (after not in states):
+                                states.append(after)
+            i += 1
+
+    # Best way to reach every orientation after one more move
+    # Takes and returns {orientation: (seconds, servo state, previous
+    # orientation, primitives)}.
+    def advance(self, layer, face, turns):
+        nxt = {}
+        for k, (seconds, s, prev, done) in layer.items():
+            for target, t, after, primitives in self.moves(k, s, face, turns):
+                t += seconds
+                best = nxt.get(target)
+                if ((best is None) or (t < best[0])):
+                    nxt[target] = (t, after, k, primitives)
+        return nxt
+
+    # Best way to reach every orientation after two moves, in either
+    # order when they commute
+    def advance_pair(self, layer, first, second):
+        nxt = {}
+        for a, b in ((first, second), (second, first)):
+            middle = self.advance(layer, a[0], a[1])
+            for target, (t, after, k, primitives) in \
+                    self.advance(middle, b[0], b[1]).items():
+                best = nxt.get(target)
+                if ((best is None) or (t < best[0])):
+                    nxt[target] = (t, after, middle[k][2], \
+                                   middle[k][3] + primitives)
+        return nxt
+
+    # Compile a list of moves
+    # Moves on opposite faces commute, each such pair is made in the
+    # order that takes less time.
+    #
+    # Inputs:
+    #   moves    List of (face letter, quarter turns) tuples
+    #   orient   CubeOrientation at the start, None for the load position
+    #   state    Servo state at the start (see servo_state), None for
+    #            both grippers holding the cube with the arms horizontal
+    #
+    # Returns the list of servo primitive names, the predicted seconds
+    # and the orientation key at the end
+    #
+    def compile(self, moves, orient=None, state=None):
+        if (orient is None):
+            orient = CubeOrientation()
+        s = self.start if (state is None) else self.state_id(state)
+
+        # Best (seconds, servo state, previous orientation, primitives)
+        # of every orientation after each move
+        layer = {self.key_id(orient.key()): (0.0, s, None, None)}
+        layers = [layer]
+        i = 0
+        while (i < len(moves)):
+            if ((i + 1 < len(moves)) and \
+                (moves[i + 1][0] == OPPOSITE_FACE[moves[i][0]])):
+                layer = self.advance_pair(layer, moves[i], moves[i + 1])
+                i += 2
+            else:
+                layer = self.advance(layer, moves[i][0], moves[i][1])
+                i += 1
+            layers.append(layer)
+
+        k = min(layer, key=lambda k: layer[k][0])
+        seconds = layer[k][0]
+        end = self.keys[k]
+        primitives = []
+        for i in range(len(layers) - 1, 0, -1):
+            step = layers[i][k]
+            primitives = step[3] + primitives
+            k = step[2]
+        return primitives, seconds, end
+
+
+# Predict how long the robot takes to make a solution
+#
+# Inputs:
+#   solve_string  Solver output
+#   servos        Servo class in its current state, or None to start
+#                 with both grippers holding the cube
+#   orient        CubeOrientation of the cube, None for the load position
+#   compiler      MoveCompiler to use, None to make one
+#
+# Returns the predicted seconds and the number of servo primitives
+#
+def predict_time(solve_string, servos=None, orient=None, compiler=None):
+    if (compiler is None):
+        compiler = MoveCompiler(servos)
+    state = None
+    if (servos is not None):
+        state = servo_state(servos)
+    moves = optimize_moves(parse_solution(solve_string))
+    primitives, seconds, end = compiler.compile(moves, orient, state)
+    return seconds, len(primitives)
@@ -0,0 +1,112 @@
+from collections import deque
+
+# Vector turns
+from rubik_cube import turn_vector
+
+
+# Face letters in cube string order
+FACE_NAMES = "URFDLB"
+
+# Positions around the cube, as unit vectors in the robot frame
+# x points at the camera, z along the right gripper axis.
+POS_CAMERA     = ( 1,  0,  0)   # Face seen by the camera
+POS_LEFT       = (-1,  0,  0)   # Face held by the left gripper
+POS_RIGHT      = ( 0,  0,  1)   # Face held by the right gripper
+POS_RIGHT_OPP  = ( 0,  0, -1)   # Face opposite the right gripper
+POS_SIDE_A     = ( 0,  1,  0)   # Faces on the remaining axis
+POS_SIDE_B     = ( 0, -1,  0)
+
+# Face positions when the cube is loaded, this is where the scanner
+# takes the first picture (the front face)
+LOAD_POSITIONS = {"F": POS_CAMERA,
+                  "B": POS_LEFT,
+                  "U": POS_RIGHT,
+                  "D": POS_RIGHT_OPP,
+                  "R": POS_SIDE_A,
+                  "L": POS_SIDE_B}
+
+# Whole cube rotations of the servo class
+# Each rotation turns the cube about the axis of one gripper by a number
+# of clockwise quarter turns, as seen from the end of the axis given.
+# The right gripper turns are seen from the face it holds, the left
+# gripper turns from the camera (the order the scanner sees the faces
+# in depends on this).
+CUBE_ROTATIONS = {"right_rotate_cube_90_cw":  (POS_RIGHT, 1),
+                  "right_rotate_cube_90_ccw": (POS_RIGHT, 3),
+                  "right_rotate_cube_180":    (POS_RIGHT, 2),
+                  "left_rotate_cube_90_cw":   (POS_CAMERA, 1),
+                  "left_rotate_cube_90_ccw":  (POS_CAMERA, 3),
+                  "left_rotate_cube_180":     (POS_CAMERA, 2)}
+
+
+# Orientation of the cube in the robot
+# Keeps track of which face is at every position as the servos rotate
+# the whole cube.
+class CubeOrientation(object):
+    def __init__(self, positions=None):
+        if (positions is None):
+            positions = LOAD_POSITIONS
+        # Position of each face
+        self.pos = dict(positions)
+
+    def copy(self):
+        return CubeOrientation(self.pos)
+
+    # Face letter at a position
+    def face_at(self, position):
+        for face, p in self.pos.items():
+            if (p == position):
+                return face
+        return None
+
+    # Rotate the whole cube about a position's axis
+    def turn(self, axis, quarters):
+        for face in self.pos:
+            self.pos[face] = turn_vector(self.pos[face], axis, quarters)
+
+    # Apply a servo class cube rotation by name
+    def apply(self, rotation):
+        axis, quarters = CUBE_ROTATIONS[rotation]
+        self.turn(axis, quarters)
+
+    # Hashable value identifying the orientation
+    def key(self):
+        return tuple(self.pos[face] for face in FACE_NAMES)
+
+    # The same orientation turned 180 degrees in front of the camera
+    # The camera sees the same face, upside down.
+    def flipped_key(self):
+        o = self.copy()
+        o.turn(POS_CAMERA, 2)
+        return o.key()
+
+
+# Find the shortest list of cube rotations between two orientations
+#
+# Inputs:
+#   start    Current CubeOrientation
+#   goals    Collection of orientation keys to reach, or a function
+#            that tells if a CubeOrientation is a goal
+#
+# Returns the list of rotation names and the key that was reached
+#
+def rotation_path(start, goals):
+    if callable(goals):
+        is_goal = goals
+    else:
+        goals = set(goals)
+        is_goal = lambda orient: orient.key() in goals
+
+    seen = {start.key()}
+    q = deque([(start, [])])
+    while q:
+        orient, path = q.popleft()
+        if is_goal(orient):
+            return path, orient.key()
+        for rotation in CUBE_ROTATIONS:
+            nxt = orient.copy()
+            nxt.apply(rotation)
+            if (nxt.key() not in seen):
+                seen.add(nxt.key())
+                q.append((nxt, path + [rotation]))
+    return None, None
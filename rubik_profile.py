@@ -0,0 +1,156 @@
+import threading
+from math import sqrt
+from time import perf_counter, sleep
+
+
+# Seconds between PWM updates of a ramped move
+# The servos take a new position once every PWM period (20 ms at 50 Hz),
+# updating them more often doesn't make them move any smoother.
+PROFILE_PERIOD = 0.02
+
+
+# Seconds a trapezoidal move takes
+# The servo speeds up at the acceleration limit, runs at the speed limit
+# and slows down again. A short move never reaches the speed limit, it
+# speeds up for half the distance and slows down for the other half.
+#
+# Inputs:
+#   distance  PWM counts to move
+#   speed     Speed limit (PWM counts per second)
+#   accel     Acceleration limit (PWM counts per second squared)
+#
+def profile_time(distance, speed, accel):
+    if (distance <= speed * speed / accel):
+        return 2 * sqrt(distance / accel)
+    return distance / speed + speed / accel
+
+
+# PWM counts covered by a trapezoidal move after a time
+#
+# Inputs:
+#   distance  PWM counts to move
+#   speed     Speed limit (PWM counts per second)
+#   accel     Acceleration limit (PWM counts per second squared)
+#   t         Seconds since the move started
+#
+def profile_position(distance, speed, accel, t):
+    total = profile_time(distance, speed, accel)
+    if (t >= total):
+        return distance
+    if (t <= 0):
+        return 0.0
+    # Top speed, lower than the limit for a short move
+    top = min(speed, sqrt(distance * accel))
+    ramp = top / accel
+    if (t < ramp):
+        return 0.5 * accel * t * t
+    if (t > total - ramp):
+        left = total - t
+        return distance - 0.5 * accel * left * left
+    return 0.5 * accel * ramp * ramp + top * (t - ramp)
+
+
+# PWM values of ramped moves at a time
+#
+# Inputs:
+#   segments  Moves as (delay, port, start PWM, end PWM, speed, accel)
+#             tuples, each starting its delay (seconds) after the first
+#   t         Seconds since the first move started
+#
+# Returns a dictionary of PWM values by port, and the moves still running
+#
+def profile_values(segments, t):
+    values = {}
+    running = []
+    for segment in segments:
+        delay, port, start, end, speed, accel = segment
+        if (t < delay):
+            running.append(segment)
+            continue
+        distance = abs(end - start)
+        covered = profile_position(distance, speed, accel, t - delay)
+        if (covered < distance):
+            running.append(segment)
+        step = int(round(covered))
+        values[port] = start + step if (end >= start) else start - step
+    return values, running
+
+
+# Ramped move runner
+#
+# Moves the servos along their profiles in the background. Every period
+# the PWM value of each moving servo is worked out from the time since
+# the moves started, and all the values that changed are written
+# together. The periods are timed from the start, so a late update
+# doesn't delay the ones after it.
+#
+class ProfileRunner(threading.Thread):
+    def __init__(self, write, period=PROFILE_PERIOD):
+        super().__init__(daemon=True)
+        # Function writing a dictionary of PWM values by port
+        self.write = write
+        self.period = period
+        # Moves running, (delay, port, start PWM, end PWM, speed, accel)
+        # tuples, and the time they were started (perf_counter seconds)
+        self.segments = []
+        self.t_start = None
+        # PWM value last written to each port by the running moves
+        self.written = {}
+        self.lock = threading.Lock()
+        self.wake = threading.Event()
+        # Set when no moves are running
+        self.idle = threading.Event()
+        self.idle.set()
+
+    # Start moves, each after its delay (seconds)
+    # Moves still running are replaced.
+    def move(self, segments):
+        with self.lock:
+            self.segments = list(segments)
+            self.t_start = perf_counter()
+            self.written = {}
+            self.idle.clear()
+        self.wake.set()
+
+    # Wait for the moves to finish
+    def wait_idle(self, timeout=None):
+        return self.idle.wait(timeout)
+
+    # Make moves in the calling thread, waiting between the updates with
+    # the wait function given
+    # Returns the seconds waited
+    def run_now(self, segments, wait):
+        t = 0.0
+        written = {}
+        while segments:
+            values, segments = profile_values(segments, t)
+            changed = {port: pwm for port, pwm in values.items() \
+                       if (written.get(port) != pwm)}
+            if changed:
+                self.write(changed)
+                written.update(changed)
+            if segments:
+                wait(self.period)
+                t += self.period
+        return t
+
+    def run(self):
+        while 1:
+            self.wake.wait()
+            self.wake.clear()
+            tick = perf_counter()
+            while 1:
+                with self.lock:
+                    values, self.segments = \
+                        profile_values(self.segments, \
+                                       perf_counter() - self.t_start)
+                    changed = {port: pwm for port, pwm in values.items() \
+                               if (self.written.get(port) != pwm)}
+                    if changed:
+                        self.write(changed)
+                        self.written.update(changed)
+                    if not self.segments:
+                        self.idle.set()
+                        break
+                tick += self.period
+                sleep(max(0.0, tick - perf_counter()))
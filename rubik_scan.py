@@ -1,15 +1,48 @@
-import os, math
-from time import sleep
+import os
+import threading
+from queue import Queue
+import numpy as np
 from PIL import Image
-# Raspberry Pi camera library
-from picamera import PiCamera
-
+# Color space and assignment helpers
+from rubik_colors import assign_colors, color_distances, color_confidence
+from rubik_colors import load_lut, lut_lookup, LUT_UNKNOWN
+# Sticker grid detection
+from rubik_grid import detect_grid_faces, load_grid, save_grid
+# Cube orientation tracking
+from rubik_orient import CubeOrientation, rotation_path, FACE_NAMES
+# Camera session
+from rubik_camera import PiCameraSession, IMG_WIDTH, IMG_HIGHT
+# Check the scanned cube can be solved
+from rubik_cube import cube_is_valid
+
+# Set this to 1 to scan the face images already in the Cube folder
+# instead of the cube in the robot (replay mode, no camera or servos)
 hasPictures = 1
 
-# The image size for my camera
-IMG_WIDTH = 640
-IMG_HIGHT = 480
+# Capture the faces straight into memory instead of JPEG files
+# Set this to 0 to go back to capturing through the Cube folder.
+CAPTURE_TO_MEMORY = 1
+
+# Set this to 1 to also save the faces captured into memory as JPEG
+# files (debug output, written by a background thread)
+SAVE_FACE_IMAGES = 0
+
+# Set this to 1 to sample each face on a worker thread while the servos
+# move the cube to the next face
+PIPELINED_SCAN = 1
 
+# Set this to 1 to assign all 54 stickers at once with exactly 9 of each
+# color, 0 to give every sticker the color of the nearest center
+CONSTRAINED_COLORS = 1
+
+# Color space used to compare stickers, "rgb" or "lab"
+# The camera saturates red and orange so much that they end up closer
+# together in Lab than in the camera's own RGB values.
+COLOR_SPACE = "rgb"
+
+# Color lookup table built from earlier scans by build_color_lut.py
+# It is used when the file exists.
+COLOR_LUT_FILE = "color_lut.bin"
 
 # Pixel locations of the centers of the 9 squares
 LEFT_COLUMN  = 180 # X coordinates of the columns
@@ -19,11 +52,201 @@ TOP_ROW      =  45 # Y coordinates of the rows
 MID_ROW      = 175
 BOTTOM_ROW   = 300
 
+# Sticker centers found by the grid detection, used instead of the
+# values above when the file exists
+GRID_CACHE_FILE = "grid_cache.txt"
+
+# Find the sticker grid again when a scan fails or the least certain
+# sticker is below this confidence
+GRID_MIN_CONFIDENCE = 0.1
+
+# Size of the square averaged around each sticker center (pixels, odd)
+SAMPLE_SIZE = 5
+
+# Faces with a sticker below this confidence are captured again
+RECAPTURE_CONFIDENCE = 0.1
+
+# Give up on selective capture and leave it to a full rescan when more
+# faces than this are unsure
+RECAPTURE_MAX_FACES = 3
+
+# Number of frames averaged when a face is captured again
+RECAPTURE_FRAMES = 3
+
+# Decoded face images of one scan
+# Every face image is decoded at most once, no matter how many times
+# it is looked at during the scan.
+class FaceSet(object):
+    def __init__(self, folder="Cube"):
+        # Folder holding the face images
+        self.folder = folder
+        # Capture buffers, allocated once and reused by every scan
+        self.buffers = np.empty((6, IMG_HIGHT, IMG_WIDTH, 3), dtype=np.uint8)
+        self.clear()
+
+    # Forget the images of the previous scan
+    def clear(self):
+        self.pixels = [None] * 6
+        # Number of image decodes done for this scan
+        self.decode_count = 0
+
+    # File name of a face image
+    def path(self, face):
+        return os.path.join(self.folder, "face" + str(face) + ".jpg")
+
+    # Get the RGB pixel array of a face, decoding the image on first use
+    def get(self, face):
+        if (self.pixels[face] is None):
+            self.keep(face, self.decode(face))
+        return self.pixels[face]
+
+    # Decode a face image without keeping it
+    # Doesn't touch the decoded images, so other threads can use it.
+    def decode(self, face):
+        im = Image.open(self.path(face))
+        im = im.convert('RGB')
+        return np.asarray(im)
+
+    # Keep a face image decoded with decode()
+    def keep(self, face, pixels):
+        self.pixels[face] = pixels
+        self.decode_count += 1
+
+    # Capture a face with the camera straight into its buffer
+    def capture(self, camera, face):
+        camera.capture(self.buffers[face], 'rgb', face)
+        self.pixels[face] = self.buffers[face]
+
+    # Get the pixel arrays of all 6 faces in U, R, F, D, L, B order
+    def get_all(self):
+        return [self.get(face) for face in range(0, 6)]
+
+
+# Background face image writer
+# Saving a JPEG is slow, so debug images are written from this thread
+# instead of holding up the scan.
+class ImageSaver(threading.Thread):
+    def __init__(self):
+        super().__init__(daemon=True)
+        # Queue of (file name, pixel array) waiting to be written
+        self.q = Queue(maxsize = 12)
+
+    # Queue a copy of the pixels, the buffer is reused by the next scan
+    def save(self, file, pixels):
+        self.q.put((file, pixels.copy()))
+
+    def run(self):
+        while 1:
+            file, pixels = self.q.get()
+            Image.fromarray(pixels).save(file)
+
+
+# Background face sampler
+# Each face is decoded and sampled as soon as it is captured, while the
+# servos are positioning the cube for the next face. Only the last face
+# is left to do once the capture is over.
+class FaceSampler(threading.Thread):
+    def __init__(self, scanner):
+        super().__init__(daemon=True)
+        # Scanner holding the face images and the sampling settings
+        self.scanner = scanner
+        # Queue of captured faces waiting to be sampled
+        self.q = Queue(maxsize = 6)
+        # Sticker colors of the current scan
+        self.samples = np.empty((6, 9, 3))
+        # Face images this thread decoded, handed to the scanner's face
+        # set by wait() in the scanner's thread
+        self.decoded = {}
+        self.error = None
+
+    # Get ready for a new scan
+    def clear(self):
+        self.q.join()
+        self.decoded = {}
+        self.error = None
+
+    # Queue a captured face for sampling
+    #
+    # Inputs:
+    #   face     Face number
+    #   pixels   RGB pixel array of the face, None to decode the image
+    #            file on this thread
+    #
+    def submit(self, face, pixels=None):
+        self.q.put((face, pixels))
+
+    # Wait until all queued faces are sampled
+    # Returns a (6, 9, 3) array of sticker colors
+    def wait(self):
+        self.q.join()
+        for face, pixels in self.decoded.items():
+            self.scanner.faces.keep(face, pixels)
+        self.decoded = {}
+        if (self.error is not None):
+            error = self.error
+            self.error = None
+            raise error
+        return self.samples.copy()
+
+    def run(self):
+        while 1:
+            face, pixels = self.q.get()
+            try:
+                if (pixels is None):
+                    pixels = self.scanner.faces.decode(face)
+                    self.decoded[face] = pixels
+                #Down face image upside down, scan in reverse
+                self.samples[face] = self.scanner.sample_face(pixels, \
+                                                              face == 3)
+            except Exception as e:
+                self.error = e
+            self.q.task_done()
+
+
 # Rubic cube scanner class
 class RubikScan(object):
-    def __init__(self, serv):
+    def __init__(self, serv, camera=None):
         # Save the servo info provided by the caller
         self.servos = serv
+        # camera session, kept open between solves
+        if (camera is None):
+            camera = PiCameraSession()
+        self.camera = camera
+        # size of the square sampled around each sticker
+        self.sample_size = SAMPLE_SIZE
+        # face images of the current scan
+        self.faces = FaceSet("Cube")
+        # scan stored face images instead of capturing them
+        self.replay = (hasPictures == 1)
+        # classifier selection and the sticker confidences of the last scan
+        self.constrained = CONSTRAINED_COLORS
+        self.color_space = COLOR_SPACE
+        self.confidence = None
+        self.labels = None
+        self.samples = None
+        # cancellation token of the running solve, None if it can't be
+        # aborted
+        self.token = None
+        # cube orientation and the orientation each face was captured in
+        self.orient = CubeOrientation()
+        self.capture_keys = [None] * 6
+        self.recapture = 1
+        self.burst = np.empty((RECAPTURE_FRAMES, IMG_HIGHT, IMG_WIDTH, 3), \
+                              dtype=np.uint8)
+        # color lookup table
+        self.lut = None
+        if os.path.exists(COLOR_LUT_FILE):
+            self.lut = load_lut(COLOR_LUT_FILE)
+        # capture mode
+        self.capture_to_memory = CAPTURE_TO_MEMORY
+        self.saver = None
+        if (SAVE_FACE_IMAGES == 1):
+            self.saver = ImageSaver()
+            self.saver.start()
+        self.sampler = None
+        if (PIPELINED_SCAN == 1):
+            self.sampler = FaceSampler(self)
+            self.sampler.start()
         # pixel locations
         self.pxl_locs = [(LEFT_COLUMN,  TOP_ROW),
                          (MID_COLUMN,   TOP_ROW),
@@ -34,6 +257,10 @@ class RubikScan(object):
                          (LEFT_COLUMN,  BOTTOM_ROW),
                          (MID_COLUMN,   BOTTOM_ROW),
                          (RIGHT_COLUMN, BOTTOM_ROW)]
+        # sticker centers found earlier
+        cached = load_grid(GRID_CACHE_FILE)
+        if (cached is not None):
+            self.pxl_locs = cached
 
         # Check if folder exists
         if not os.path.exists("Cube"):
@@ -41,175 +268,366 @@ class RubikScan(object):
             os.chmod("Cube", 0o777)
 
 
-    # Initialize the camera
+    # Open the camera session
+    # The camera stays open and warm between solves, calling this again
+    # does nothing.
     def camera_init(self):
-        # init camera driver/hardware
-        self.camera = PiCamera()
-        self.camera.resolution = (IMG_WIDTH, IMG_HIGHT)
-        self.camera.start_preview()
-        self.camera.iso = 400
+        self.camera.open()
+
+    # Rotate the whole cube with one of the servo class cube rotations
+    def rotate_cube(self, rotation):
+        getattr(self.servos, rotation)()
+        self.orient.apply(rotation)
+
+    # Stop with an AbortException if the solve was cancelled
+    def check_abort(self):
+        if (self.token is not None):
+            self.token.check()
+
+    # Capture one face of the cube
+    def capture_face(self, face):
+        self.check_abort()
+        self.capture_keys[face] = self.orient.key()
+        pixels = None
+        if (self.capture_to_memory):
+            self.faces.capture(self.camera, face)
+            pixels = self.faces.get(face)
+            if (self.saver is not None):
+                self.saver.save(self.faces.path(face), pixels)
+        else:
+            self.camera.capture(self.faces.path(face), face=face)
+        if (self.sampler is not None):
+            self.sampler.submit(face, pixels)
 
     # Read cube faces
     def get_cube(self):
-        # Set the camera exposure settings.
-        es = self.camera.exposure_speed
-        self.camera.exposure_mode = 'off'
-        self.camera.shutter_speed = es
-        g = self.camera.awb_gains
-        self.camera.awb_mode = 'off'
-        self.camera.awb_gains = g
-
-        self.camera.saturation = 50
-        sleep(2)
+        # Fix the exposure settings, measured once and then reused
+        self.camera.lock(self.token)
+        # the cube was just loaded
+        self.orient = CubeOrientation()
 
         #getting faces
-        try:
-            self.camera.capture('Cube/face2.jpg')
+        self.capture_face(2)
 
-            self.servos.right_rotate_cube_90_cw()
-            self.servos.clear_camera()
+        self.rotate_cube("right_rotate_cube_90_cw")
+        self.servos.clear_camera()
 
-            self.camera.capture('Cube/face1.jpg')
+        self.capture_face(1)
 
-            self.servos.right_rotate_cube_90_cw()
-            self.servos.clear_camera()
+        self.rotate_cube("right_rotate_cube_90_cw")
+        self.servos.clear_camera()
 
-            self.camera.capture('Cube/face5.jpg')
+        self.capture_face(5)
 
-            self.servos.right_rotate_cube_90_cw()
-            self.servos.clear_camera()
+        self.rotate_cube("right_rotate_cube_90_cw")
+        self.servos.clear_camera()
 
-            self.camera.capture('Cube/face4.jpg')
-
-            self.servos.left_rotate_cube_90_cw()
-            self.servos.right_rotate_cube_90_cw()
-            self.servos.clear_camera()
+        self.capture_face(4)
 
-            self.camera.capture('Cube/face0.jpg')
+        self.rotate_cube("left_rotate_cube_90_cw")
+        self.rotate_cube("right_rotate_cube_90_cw")
+        self.servos.clear_camera()
 
-            self.servos.right_rotate_cube_180()
-            self.servos.clear_camera()
+        self.capture_face(0)
 
-            self.camera.capture('Cube/face3.jpg')
+        self.rotate_cube("right_rotate_cube_180")
+        self.servos.clear_camera()
 
-        finally:
-            # Release the camera
-            self.camera.close()
+        self.capture_face(3)
 
 
     def scan_cube(self):
+        # Start with no decoded images
+        self.faces.clear()
+        if (self.sampler is not None):
+            self.sampler.clear()
+
         # Get images for all sides of the cube.
-        
-        if (hasPictures == 0):
+        samples = None
+        if not self.replay:
             self.get_cube()
-        else:
-            self.camera.close()
+            if (self.sampler is not None):
+                # faces were sampled while the cube was moving
+                samples = self.sampler.wait()
         # color of each square.
-        return self.get_colors() 
-
-
-    # Average the pixel color in 5x5
-    def pix_average(self, im, x, y):
-        # Clear values
-        r_avg = 0
-        g_avg = 0
-        b_avg = 0
-
-        # x and y in corner
-        x -= 2
-        y -= 2
-
-        # Add the RGB values together
-        for x_inc in range (0,5):
-            for y_inc in range (0,5):
-                # Read the RGB values for single pixel
-                r_pix, g_pix, b_pix = im.getpixel((x + x_inc, y + y_inc))
-                r_avg += r_pix
-                g_avg += g_pix
-                b_avg += b_pix
+        result = self.get_colors(samples)
+
+        # The stickers may have moved, look for them again
+        if ((result[0] != True) or \
+            (self.confidence.min() < GRID_MIN_CONFIDENCE)):
+            result = self.relocate_grid(result)
+
+        # Take another look at the faces that are still unsure
+        if ((not self.replay) and self.recapture):
+            result = self.recapture_faces(result)
+
+        # Still unsure, the locked exposure and white balance may not fit
+        # the light any more. They are measured again for the next scan,
+        # so all the faces of a scan share the same settings.
+        if ((not self.replay) and \
+            ((result[0] != True) or \
+             (self.confidence.min() < GRID_MIN_CONFIDENCE))):
+            print("Measuring the camera settings again next scan")
+            self.camera.unlock()
+        return result
+
+
+    # Scan a stored set of face images instead of the cube in the robot
+    #
+    # Input:
+    #   folder   Folder holding face0.jpg ... face5.jpg
+    #
+    # Returns the (success, cube string) of the scan
+    #
+    def replay_scan(self, folder="Cube"):
+        replay = self.replay
+        old_folder = self.faces.folder
+        self.replay = True
+        self.faces.folder = folder
+        try:
+            return self.scan_cube()
+        finally:
+            self.replay = replay
+            self.faces.folder = old_folder
+
+
+    # Faces that need another look
+    # A face is unsure if it has a sticker with low confidence or a
+    # sticker of a color that has more than 9 stickers.
+    def unsure_faces(self):
+        unsure = np.any(self.confidence < RECAPTURE_CONFIDENCE, axis=1)
+        counts = np.bincount(self.labels.ravel(), minlength=6)
+        over = counts[self.labels] > 9
+        unsure |= np.any(over, axis=1)
+        return [face for face in range(0, 6) if unsure[face]]
+
+
+    # Capture a face again, averaging a burst of frames
+    # The face must be in front of the camera, upside down if flipped.
+    def capture_burst(self, face, flipped=False):
+        for frame in range(0, RECAPTURE_FRAMES):
+            self.check_abort()
+            # The middle sticker is the center the cube turns about
+            self.camera.capture(self.burst[frame], 'rgb', face, flipped, \
+                                self.pxl_locs[4])
+        pixels = np.rint(self.burst.mean(axis=0)).astype(np.uint8)
+        # An upside down image doesn't line up with the sticker grid, the
+        # face image of the scan is kept then
+        if not flipped:
+            self.faces.pixels[face] = pixels
+        return pixels
+
+
+    # Capture and sample only the unsure faces again
+    # The cube is rotated along the shortest path to each face.
+    #
+    # Input:
+    #   result   (success, cube string) of the scan
+    #
+    # Returns the (success, cube string) of the improved scan
+    #
+    def recapture_faces(self, result):
+        faces = self.unsure_faces()
+        if ((len(faces) == 0) or (len(faces) > RECAPTURE_MAX_FACES)):
+            return result
+        print("Capturing faces again " + str(faces))
+
+        samples = self.samples.copy()
+        while (len(faces) > 0):
+            # Go to the nearest unsure face
+            best = None
+            for face in faces:
+                key = self.capture_keys[face]
+                flipped = CubeOrientation(dict(zip(FACE_NAMES, key))).flipped_key()
+                path, reached = rotation_path(self.orient, [key, flipped])
+                if ((best is None) or (len(path) < len(best[1]))):
+                    best = (face, path, reached != key)
+            face, path, upside_down = best
+            faces.remove(face)
+
+            for rotation in path:
+                self.rotate_cube(rotation)
+            self.servos.clear_camera()
 
+            #Down face image upside down, scan in reverse
+            reverse = (face == 3) != upside_down
+            samples[face] = self.sample_face( \
+                                self.capture_burst(face, upside_down), reverse)
+
+        return self.get_colors(samples)
+
+
+    # Find the sticker grid in the face images of this scan
+    # The new sticker centers are kept and saved to the cache when they
+    # give a better scan.
+    #
+    # Input:
+    #   result   (success, cube string) of the scan with the current grid
+    #
+    # Returns the (success, cube string) of the better of the two grids
+    #
+    def relocate_grid(self, result):
+        locs = detect_grid_faces(self.faces.get_all())
+        if ((locs is None) or (locs == self.pxl_locs)):
+            return result
+
+        old_locs = self.pxl_locs
+        old_confidence = self.confidence
+        old_samples = self.samples
+        old_labels = self.labels
+        self.pxl_locs = locs
+        new_result = self.get_colors()
+        # Fewer unsure stickers is better, then a higher average confidence
+        old_unsure = np.count_nonzero(old_confidence < GRID_MIN_CONFIDENCE)
+        new_unsure = np.count_nonzero(self.confidence < GRID_MIN_CONFIDENCE)
+        better = (new_unsure < old_unsure) or \
+                 ((new_unsure == old_unsure) and \
+                  (self.confidence.mean() > old_confidence.mean()))
+        if ((new_result[0] == True) and ((result[0] != True) or better)):
+            print("Sticker grid moved")
+            save_grid(GRID_CACHE_FILE, locs)
+            return new_result
+
+        self.pxl_locs = old_locs
+        self.confidence = old_confidence
+        self.samples = old_samples
+        self.labels = old_labels
+        return result
+
+
+    # Average the pixel color in a square around each of the 9 stickers
+    # of one face. All the squares are pulled out with a single index
+    # operation.
+    #
+    # Inputs:
+    #   pixels   RGB pixel array of the face (rows, columns, 3)
+    #   reverse  Scan the stickers in reverse (upside down face)
+    #
+    # Returns a (9, 3) array of RGB averages
+    #
+    def sample_face(self, pixels, reverse=False):
+        half = self.sample_size // 2
+        offs = np.arange(-half, half + 1)
+        locs = np.array(self.pxl_locs)
+        # Row and column of every pixel of every square (9, size, size)
+        rows = locs[:, 1, None, None] + offs[None, :, None]
+        cols = locs[:, 0, None, None] + offs[None, None, :]
+        squares = pixels[rows, cols]
         # average of values
-        r_avg = r_avg / 25
-        g_avg = g_avg / 25
-        b_avg = b_avg / 25
-
-        return r_avg, g_avg, b_avg
-
+        avg = squares.sum(axis=(1, 2), dtype=np.int64) / (self.sample_size ** 2)
+        if (reverse):
+            avg = avg[::-1]
+        return avg
+
+
+    # Sample the 9 stickers of all 6 faces
+    #
+    # Input:
+    #   faces    List of 6 RGB pixel arrays in U, R, F, D, L, B order
+    #
+    # Returns a (6, 9, 3) array of RGB averages
+    #
+    def sample_faces(self, faces):
+        samples = np.empty((6, 9, 3))
+        for img_iter in range(0, 6):
+            #Down face image upside down, scan in reverse
+            samples[img_iter] = self.sample_face(faces[img_iter], \
+                                                 img_iter == 3)
+        return samples
+
+
+    # Assign every sticker to the nearest center color
+    #
+    # Inputs:
+    #   samples  (6, 9, 3) array of sticker colors
+    #   centers  (6, 3) array of center colors in U, R, F, D, L, B order
+    #
+    # Returns a (6, 9) array of center indexes
+    #
+    def classify(self, samples, centers):
+        # euclidian distance of every sticker to every center (6, 9, 6)
+        diff = samples[:, :, None, :] - centers[None, None, :, :]
+        dist = diff[..., 0] ** 2 + diff[..., 1] ** 2 + diff[..., 2] ** 2
+        # minimum value, first center wins a tie
+        return np.argmin(dist, axis=2)
+
+
+    # Classify the stickers with the color lookup table
+    # Stickers outside the table's confidence region get the color of the
+    # nearest center.
+    #
+    # Inputs:
+    #   samples  (6, 9, 3) array of sticker colors
+    #   centers  (6, 3) array of center colors in U, R, F, D, L, B order
+    #
+    # Returns a (6, 9) array of center indexes, or None if the table
+    # can't be used for this scan
+    #
+    def classify_lut(self, samples, centers):
+        colors = lut_lookup(self.lut, samples)
+
+        # The centers tell which face each color belongs to
+        center_colors = colors[:, 4]
+        if ((LUT_UNKNOWN in center_colors) or \
+            (len(set(center_colors.tolist())) != 6)):
+            return None
+        color_face = np.full(256, -1)
+        color_face[center_colors] = np.arange(6)
+        labels = color_face[colors]
+
+        # Stickers the table doesn't know or that got a color no center has
+        unknown = labels < 0
+        self.confidence = np.ones((6, 9))
+        if (np.any(unknown)):
+            nearest = self.classify(samples, centers)
+            labels[unknown] = nearest[unknown]
+            dist = color_distances(samples[unknown], centers, self.color_space)
+            self.confidence[unknown] = color_confidence(dist, labels[unknown])
+
+        # Let the full classifier sort out a bad count
+        if (np.any(np.bincount(labels.ravel(), minlength=6) != 9)):
+            return None
+        return labels
 
-    #Getting cube string
-    def get_center_color(self, text, file):
-        im = Image.open(file)
-        im = im.convert('RGB')
-        #im.save('Cube/debug.jpg')
-        r, g, b = self.pix_average(im, \
-                                   self.pxl_locs[4][0], \
-                                   self.pxl_locs[4][1])
-        return r, g, b 
 
     # Get the color of each square on the cube
-    def get_colors(self):
-        # get the center colors to identify other squares
-        center_colors = []
+    #
+    # Input:
+    #   samples  (6, 9, 3) array of sticker colors, None to sample the
+    #            face images now
+    #
+    def get_colors(self, samples=None):
         print("vypis fareb")
-        r, g, b = self.get_center_color("Face 0 - Up", "Cube/face0.jpg")
-        center_colors.append((r, g, b, "U"))
-
-        r, g, b = self.get_center_color("Face 1 - Right", "Cube/face1.jpg")
-        center_colors.append((r, g, b, "R"))
-
-        r, g, b = self.get_center_color("Face 2 - Front", "Cube/face2.jpg")
-        center_colors.append((r, g, b, "F"))
-
-        r, g, b = self.get_center_color("Face 3 - Down", "Cube/face3.jpg")
-        center_colors.append((r, g, b, "D"))
-
-        r, g, b = self.get_center_color("Face 4 - Left", "Cube/face4.jpg")
-        center_colors.append((r, g, b, "L"))
-
-        r, g, b = self.get_center_color("Face 5 - Back", "Cube/face5.jpg")
-        center_colors.append((r, g, b, "B"))
+        if (samples is None):
+            samples = self.sample_faces(self.faces.get_all())
+        self.samples = samples
+
+        # the center colors identify other squares
+        centers = samples[:, 4, :]
+        print(centers)
+
+        labels = None
+        if (self.lut is not None):
+            labels = self.classify_lut(samples, centers)
+
+        if (labels is None):
+            if (self.constrained):
+                labels, self.confidence = assign_colors(samples, centers, \
+                                                        self.color_space)
+            else:
+                labels = self.classify(samples, centers)
+                self.confidence = color_confidence( \
+                                      color_distances(samples, centers, \
+                                                      self.color_space), \
+                                      labels.ravel()).reshape(6, 9)
+
+        self.labels = labels
 
         # for holding cube string
-        cube_def_string = ""
+        cube_def_string = "".join(FACE_NAMES[i] for i in labels.ravel())
 
         # for counting separate colors
-        color_count = [0, 0, 0, 0, 0, 0]
-
-        # Loop through the 6 faces
-        for img_iter in range(0, 6):
-            img_path = "Cube/face" + str(img_iter) + ".jpg"
-            im = Image.open(img_path)
-            im = im.convert('RGB')
-
-            # Loop through the 9 squares on a face
-            for pix_iter in range(0,9):
-                if (img_iter == 3):
-                    #Down face image upside down, scan in reverse
-                    r, g, b = self.pix_average(im, \
-                                              self.pxl_locs[8 - pix_iter][0], \
-                                              self.pxl_locs[8 - pix_iter][1])
-                else:
-                    r, g, b = self.pix_average(im, \
-                                              self.pxl_locs[pix_iter][0], \
-                                              self.pxl_locs[pix_iter][1])
-                                              
-                #euclidian trough minimum value                              
-                min_dist = -1
-                face = 'X'
-                print(center_colors)
-                for index in range(0, len(center_colors)):
-                    cc_r, cc_g, cc_b, f = center_colors[index]
-                    dist = math.pow(r - cc_r, 2) + math.pow(g - cc_g, 2) \
-                           + math.pow(b - cc_b, 2)
-
-                    if((min_dist == -1) or (dist < min_dist)):
-                        min_dist = dist
-                        face = f
-                        min_index = index
-
-                # append square color to cube string.
-                cube_def_string = cube_def_string + face
-                color_count[min_index] += 1
+        color_count = np.bincount(labels.ravel(), minlength=6)
 
         print("tu vypise cube def string")
         print(cube_def_string)
@@ -221,5 +639,10 @@ class RubikScan(object):
         for index in range(0, 6):
             if (color_count[index] != 9):
                 success = False
-                
+
+        # The constrained classifier always finds 9 of each color, the
+        # stickers must also make up a cube that can be solved
+        if (success and not cube_is_valid(cube_def_string)):
+            success = False
+
         return success, cube_def_string
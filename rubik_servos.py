@@ -1,64 +1,184 @@
-# Import I2C pins.
-import board
-import busio
-
 # Needed for file I/O functions
 import os
+import struct
+
+# PWM board and clock the servos run on
+from rubik_backend import hardware_pca, SystemClock, PCA_LED0_ON_L
+
+# Button values
+from rubik_buttons import UP_BUTTON, DOWN_BUTTON, ENTER_BUTTON
 
-from time import sleep
+# Servo positions and the fastest servo moves of every primitive
+from rubik_transitions import T_POS_M90, T_POS_0, T_POS_P90
+from rubik_transitions import G_POS_OPEN, G_POS_LOAD, G_POS_CLOSED
+from rubik_transitions import TransitionTable, RT, RG, LT, LG, move_loaded
 
-# Library to control the PCA9685 PWM board that drives the servos
-from adafruit_pca9685 import PCA9685
+# Grouping of servo moves that can run at the same time
+from rubik_motion import schedule_moves, apply_move
 
-# Button detection class
-from rubik_buttons import RubikButtons, UP_BUTTON, DOWN_BUTTON, ENTER_BUTTON
+# Ramped servo moves
+from rubik_profile import ProfileRunner, profile_time
 
 
 # Set this to 0 to disable debug logging, 1 to enable.
 DEBUG = 0
 
 
-# Delay to allow servos to move (seconds)
-# This time is probably conservative but I would rather be a litle slow
-# than have errors caused by moving the servos too fast.
-SERVO_MOVE_DELAY = 1.0
+# Time to allow servos to move
+# Every move waits for the servo to cover the PWM distance at its speed
+# plus a settle time, times a safety factor. The values are read from
+# the timing file kept next to the calibration file, these defaults are
+# used without one. They are probably conservative but I would rather be
+# a litle slow than have errors caused by moving the servos too fast.
+SERVO_TIMING_FILE   = "servo_timing.txt"
+SERVO_SAFETY_FACTOR = 1.5   # Multiplies every move time
+SERVO_SETTLE_TIME   = 0.1   # Seconds added to every move
+SERVO_SPEED         = 500   # PWM counts per second
+
+# Ramped moves
+# Stepping a servo straight to a new position jerks the cube, which is
+# why the speeds above are low. In the motion profile mode the PWM value
+# is moved along a ramp instead, within a speed and an acceleration
+# limit for each servo, with lower limits when the servo carries the
+# cube (see move_loaded). The mode and the limits are read from the
+# profile file, these defaults are used without one.
+SERVO_PROFILE_FILE  = "servo_profile.txt"
+SERVO_PROFILE_SPEED = 1200          # PWM counts per second
+SERVO_PROFILE_ACCEL = 12000         # PWM counts per second squared
+SERVO_PROFILE_LOADED_SPEED = 800    # Carrying the cube
+SERVO_PROFILE_LOADED_ACCEL = 8000
 
 # Current servo positions
 # These are used to optimize the servo move functions by keeping track
 # of the current servo positions. This avoids having to move the servos
-# back to a "home" position between movements. It does however make
-# the servo logic more cpmplex.
-# The actual values aren't important, they just need to be unique.
+# back to a "home" position between movements. The moves each primitive
+# makes from the current positions come from the transition table.
+# The position values (T_POS_*, G_POS_*) are defined with the table.
+
+# Position and PWM port attributes of each servo, in servo state order
+POS_ATTRS = ("rt_pos", "rg_pos", "lt_pos", "lg_pos")
+PORT_ATTRS = ("rt", "rg", "lt", "lg")
+
+
+# I2C transfers that write PWM values
+#
+# Each PCA9685 channel has 4 registers (on time low and high byte, off
+# time low and high byte) from LED0_ON_L on, and the chip steps to the
+# next register after every byte (the adafruit library turns that on).
+# Ports next to each other are written in one transfer. A gap between
+# them is filled with the values its ports already have when they are
+# known, otherwise the transfer is split there. The on time of a port
+# written before is already 0, a single port like that only needs its
+# off time written.
+#
+# Inputs:
+#   values   Dictionary of PWM values to write, by port
+#   known    Dictionary of the PWM values written to the ports before
+#
+# Returns a list of byte strings, each the register number and the data
+# of one transfer
 #
-# Turn servos
-T_POS_M90    = 0    # Counterclockwise 90 degree position
-T_POS_0      = 1    # Center (horizontal) position
-T_POS_P90    = 2    # Clockwise 90 degree position
-# Grip servos
-G_POS_OPEN   = 0    # Grip fully open position
-G_POS_LOAD   = 1    # Grip in the load cube position
-G_POS_CLOSED = 2    # Grip closed position
+def pwm_transfers(values, known):
+    transfers = []
+    ports = sorted(values)
+    i = 0
+    while (i < len(ports)):
+        first = ports[i]
+        run = [values[first]]
+        last = first
+        i += 1
+        while (i < len(ports)):
+            gap = range(last + 1, ports[i])
+            if not all(port in known for port in gap):
+                break
+            run += [known[port] for port in gap]
+            run.append(values[ports[i]])
+            last = ports[i]
+            i += 1
+        if ((len(run) == 1) and (first in known)):
+            data = bytearray([PCA_LED0_ON_L + 4 * first + 2])
+            data += struct.pack("<H", run[0])
+        else:
+            data = bytearray([PCA_LED0_ON_L + 4 * first])
+            for pwm in run:
+                # On at the start of the period, off after the PWM count
+                data += struct.pack("<HH", 0, pwm)
+        transfers.append(bytes(data))
+    return transfers
 
 
 # Rubik solver servo class
 #
+# The PWM board and the clock can be replaced, by the simulated board and
+# a virtual clock from rubik_backend to run the servos without hardware.
+#
 class RubikServo(object):
-    def __init__(self, button_q):
+    def __init__(self, button_q, pca=None, clock=None):
         # Save the button queue class reference
         self.btn_q = button_q
 
         # Servo calibration file name
         self.cal_file = "servo_tune.txt"
 
-        # I2C bus used to communicate with the PWM hardware
-        i2c = busio.I2C(board.SCL, board.SDA)
+        # PWM driver, the board on the I2C bus unless one is given
+        if (pca is None):
+            pca = hardware_pca()
+        self.pca = pca
+
+        # Clock the servo moves are timed on
+        if (clock is None):
+            clock = SystemClock()
+        self.clock = clock
+
+        # Cancellation token of the running solve (see rubik_cancel), None
+        # when the moves can't be aborted
+        self.token = None
 
-        # PWM driver
-        self.pca = PCA9685(i2c)
+        # Servo timing and motion profile file names
+        self.timing_file = SERVO_TIMING_FILE
+        self.profile_file = SERVO_PROFILE_FILE
+
+        # PWM values waiting to be written together, None when each value
+        # is written as it is set, and the last value written to each port
+        self.pending = None
+        self.pwm_values = {}
 
         try:
-            f=open(self.cal_file, 'r')
             # Read the saved calibration values
+            self.read_calibration()
+        except:
+            print("Calibration file error")
+            raise
+        else:
+            print("Calibration file found")
+        self.read_timing()
+        self.read_profile()
+
+        # Fastest servo moves of every primitive, and the thread making
+        # the ramped moves (None to step the servos)
+        self.profiler = None
+        self.set_profiles(self.profiles)
+
+        # Set the frequency for all PWM channels
+        self.pca.frequency = self.pwm_freq
+
+        # Set the initial PWM value for all ports, in one write
+        self.batch()
+        self.set_pwm_value(self.rt, self.rt_cal_0)
+        self.rt_pos = T_POS_0
+        self.set_pwm_value(self.rg, self.rg_cal_open)
+        self.rg_pos = G_POS_OPEN
+        self.set_pwm_value(self.lt, self.lt_cal_0)
+        self.lt_pos = T_POS_0
+        self.set_pwm_value(self.lg, self.lg_cal_open)
+        self.lg_pos = G_POS_OPEN
+        self.flush()
+
+
+    # Read the calibration file
+    def read_calibration(self):
+        f=open(self.cal_file, 'r')
+        try:
             self.pwm_freq = self.read_tune_val(f)
             self.pwm_min = self.read_tune_val(f)
             self.pwm_max = self.read_tune_val(f)
@@ -78,29 +198,61 @@ class RubikServo(object):
             self.lg_cal_close = self.read_tune_val(f)
             self.lg_cal_open = self.read_tune_val(f)
             self.lg_cal_load = self.read_tune_val(f)
-
-            f.close() 
-        except:
-            f.close() 
-            print("Calibration file error")
-            raise
-        else:
-            print("Calibration file found")
-
-        # Set the frequency for all PWM channels
-        self.pca.frequency = self.pwm_freq
-
-        # Set the initial PWM value for all ports
-        # The shift left is needed to put a 12 bit value into a
-        # 16 bit register
-        self.set_pwm_value(self.rt, self.rt_cal_0)
-        self.rt_pos = T_POS_0
-        self.set_pwm_value(self.rg, self.rg_cal_open)
-        self.rg_pos = G_POS_OPEN
-        self.set_pwm_value(self.lt, self.lt_cal_0)
-        self.lt_pos = T_POS_0
-        self.set_pwm_value(self.lg, self.lg_cal_open)
-        self.lg_pos = G_POS_OPEN
+        finally:
+            f.close()
+
+
+    # Read the timing file, the defaults are used without one
+    def read_timing(self):
+        self.safety_factor = SERVO_SAFETY_FACTOR
+        self.settle_time = SERVO_SETTLE_TIME
+        # Speed of each servo, in servo state order
+        self.speeds = [SERVO_SPEED] * 4
+        if not os.path.exists(self.timing_file):
+            return
+        f=open(self.timing_file, 'r')
+        try:
+            self.safety_factor = self.read_tune_float(f)
+            self.settle_time = self.read_tune_float(f)
+            for servo in (RG, RT, LG, LT):
+                self.speeds[servo] = self.read_tune_float(f)
+        finally:
+            f.close()
+
+
+    # Read the motion profile file, the defaults are used without one
+    def read_profile(self):
+        self.profiles = False
+        # Speed and acceleration limits of each servo, in servo state
+        # order, moving freely and carrying the cube
+        self.profile_limits = \
+            [((SERVO_PROFILE_SPEED, SERVO_PROFILE_ACCEL), \
+              (SERVO_PROFILE_LOADED_SPEED, SERVO_PROFILE_LOADED_ACCEL))] * 4
+        if not os.path.exists(self.profile_file):
+            return
+        f=open(self.profile_file, 'r')
+        try:
+            self.profiles = (self.read_tune_val(f) == 1)
+            for servo in (RG, RT, LG, LT):
+                free = (self.read_tune_float(f), self.read_tune_float(f))
+                loaded = (self.read_tune_float(f), self.read_tune_float(f))
+                self.profile_limits[servo] = (free, loaded)
+        finally:
+            f.close()
+
+
+    # Turn the motion profile mode on or off
+    # The move times change, so the transition table is filled again.
+    def set_profiles(self, on):
+        self.profiles = on
+        self.transitions = TransitionTable(self.move_time)
+        if not on:
+            self.profiler = None
+        elif (self.profiler is None):
+            self.profiler = ProfileRunner(self.write_pwm)
+            # On any other clock the moves are ramped as they are made
+            if isinstance(self.clock, SystemClock):
+                self.profiler.start()
 
 
     def read_tune_val(self, fh):
@@ -110,25 +262,233 @@ class RubikServo(object):
         return val
 
 
+    def read_tune_float(self, fh):
+        tune_line  = fh.readline()
+        tune_spilt = tune_line.split(" ")
+        val = float(tune_spilt[0])
+        return val
+
+
+    # Wait for the servos to move
+    # The wait ends with an AbortException if the solve is cancelled.
+    def wait(self, seconds):
+        self.clock.sleep(seconds, self.token)
+
+
+    # Calibrated PWM value of a servo position
+    def position_pwm(self, servo, pos):
+        if (servo == RT):
+            return (self.rt_cal_m90, self.rt_cal_0, self.rt_cal_90)[pos]
+        if (servo == RG):
+            return (self.rg_cal_open, self.rg_cal_load, self.rg_cal_close)[pos]
+        if (servo == LT):
+            return (self.lt_cal_m90, self.lt_cal_0, self.lt_cal_90)[pos]
+        return (self.lg_cal_open, self.lg_cal_load, self.lg_cal_close)[pos]
+
+
+    # Time a servo needs to move between two PWM values (seconds)
+    # Carrying the cube only matters to ramped moves.
+    def pwm_time(self, servo, start, end, loaded=False):
+        if self.profiles:
+            speed, accel = self.profile_limits[servo][loaded]
+            travel = profile_time(abs(end - start), speed, accel)
+        else:
+            travel = abs(end - start) / self.speeds[servo]
+        return (travel + self.settle_time) * self.safety_factor
+
+
+    # PWM value a gripper opens to first when it opens from closed
+    # Opening just a little first avoids messing up the cube.
+    def grip_partial_pwm(self, servo):
+        if (servo == RG):
+            return int((self.rg_cal_close + self.rg_cal_load)/2)
+        return int((self.lg_cal_close + self.lg_cal_load)/2)
+
+
+    # Time a servo needs to move between two positions (seconds)
+    def move_time(self, servo, start, end, loaded=False):
+        start_pwm = self.position_pwm(servo, start)
+        end_pwm = self.position_pwm(servo, end)
+        if ((servo in (RG, LG)) and (start == G_POS_CLOSED) and \
+            (end == G_POS_OPEN)):
+            partial = self.grip_partial_pwm(servo)
+            return self.pwm_time(servo, start_pwm, partial, loaded) + \
+                   self.pwm_time(servo, partial, end_pwm, loaded)
+        return self.pwm_time(servo, start_pwm, end_pwm, loaded)
+
+
+    # Current servo state, (right turn, right grip, left turn, left grip)
+    def state(self):
+        return (self.rt_pos, self.rg_pos, self.lt_pos, self.lg_pos)
+
+
+    # Make the servo moves of a primitive from the transition table
+    def transition(self, name):
+        if(DEBUG == 1):
+            print(name)
+        path = self.transitions.path(name, self.state())
+        if (path is None):
+            raise ValueError(name + " needs the cube held by a gripper")
+        self.run_moves(path)
+
+
+    # Run primitives with independent servo moves overlapped
+    # The servo moves of all the primitives are taken from the transition
+    # table and grouped, the moves of each group start together and the
+    # next group starts when the slowest of them is done.
+    def run_primitives(self, primitives):
+        moves = []
+        state = self.state()
+        for name in primitives:
+            path = self.transitions.path(name, state)
+            if (path is None):
+                raise ValueError(name + " needs the cube held by a gripper")
+            for servo, pos in path:
+                moves.append((servo, pos))
+                state = apply_move(state, servo, pos)
+        self.run_moves(moves)
+
+
+    # Make servo moves, the ones that don't depend on each other at the
+    # same time. Moves to where a servo already is are left out.
+    def run_moves(self, moves):
+        needed = []
+        state = self.state()
+        for servo, pos in moves:
+            if (state[servo] != pos):
+                needed.append((servo, pos))
+                state = apply_move(state, servo, pos)
+        for group in schedule_moves(self.state(), needed):
+            self.move_group(group)
+
+
+    # Start servo moves together and wait for the slowest one
+    # A closed gripper that opens still opens a little first. In the
+    # motion profile mode the moves are ramped by the profile thread,
+    # otherwise the servos are stepped to their new positions.
+    # When the moves are aborted the servos are sent straight to where
+    # they were going, so the servo state stays right for cube_release.
+    def move_group(self, moves):
+        if (DEBUG == 1):
+            print("move_group " + str(moves))
+        self.check_abort()
+        state = self.state()
+        longest = 0.0
+        # Servo moves as (delay, servo, port, start PWM, end PWM, loaded)
+        steps = []
+        for servo, pos in moves:
+            start = getattr(self, POS_ATTRS[servo])
+            port = getattr(self, PORT_ATTRS[servo])
+            loaded = move_loaded(state, servo, pos)
+            longest = max(longest, self.move_time(servo, start, pos, loaded))
+            start_pwm = self.position_pwm(servo, start)
+            end_pwm = self.position_pwm(servo, pos)
+            if ((servo in (RG, LG)) and (start == G_POS_CLOSED) and \
+                (pos == G_POS_OPEN)):
+                partial = self.grip_partial_pwm(servo)
+                steps.append((0.0, servo, port, start_pwm, partial, loaded))
+                steps.append((self.pwm_time(servo, start_pwm, partial, loaded), \
+                              servo, port, partial, end_pwm, loaded))
+            else:
+                steps.append((0.0, servo, port, start_pwm, end_pwm, loaded))
+            setattr(self, POS_ATTRS[servo], pos)
+
+        try:
+            self.make_steps(steps, longest)
+        except BaseException:
+            self.pending = None
+            if (self.profiler is not None):
+                self.profiler.move([])
+            self.write_pwm({port: end for delay, servo, port, start, end, \
+                            loaded in sorted(steps)})
+            raise
+
+
+    # Make the servo moves of a group, see move_group
+    def make_steps(self, steps, longest):
+        if (self.profiler is not None):
+            segments = [(delay, port, start, end) + \
+                        self.profile_limits[servo][loaded] \
+                        for delay, servo, port, start, end, loaded in steps]
+            if self.profiler.is_alive():
+                self.profiler.move(segments)
+                self.wait(longest)
+                self.profiler.wait_idle()
+            else:
+                self.wait(longest - self.profiler.run_now(segments, self.wait))
+            return
+
+        self.batch()
+        for delay, servo, port, start, end, loaded in steps:
+            if (delay == 0):
+                self.set_pwm_value(port, end)
+        self.flush()
+        elapsed = 0.0
+        for delay, servo, port, start, end, loaded in sorted(steps):
+            if (delay > 0):
+                self.wait(delay - elapsed)
+                elapsed = delay
+                self.set_pwm_value(port, end)
+        self.wait(longest - elapsed)
+
+
+    # Stop with an AbortException if the solve was cancelled
+    def check_abort(self):
+        if (self.token is not None):
+            self.token.check()
+
+
     def set_pwm_value(self, port, pwm):
-        # If the user pressed a button then abort
-        if (self.btn_q.qsize() > 0):
-            # Discard the button
-            self.btn_q.get(False, 0)
-            raise KeyboardInterrupt
+        if (self.pending is not None):
+            self.pending[port] = pwm
+            return
+        self.check_abort()
+        self.write_pwm({port: pwm})
+
 
-        self.pca.channels[port].duty_cycle = pwm << 4
+    # Hold the PWM values set from now on until flush, so they are all
+    # written together
+    def batch(self):
+        if (self.pending is None):
+            self.pending = {}
 
 
+    # Write the PWM values held since batch
+    def flush(self):
+        pending = self.pending
+        self.pending = None
+        if pending:
+            self.check_abort()
+            self.write_pwm(pending)
+
+
+    # Write PWM values to the PWM board, see pwm_transfers
+    #
+    # Input:
+    #   values   Dictionary of PWM values by port
+    #
+    def write_pwm(self, values):
+        device = getattr(self.pca, "i2c_device", None)
+        if (device is None):
+            # Driver without direct register access
+            for port, pwm in values.items():
+                # The shift left is needed to put a 12 bit value into a
+                # 16 bit register
+                self.pca.channels[port].duty_cycle = pwm << 4
+                self.pwm_values[port] = pwm
+            return
+        for data in pwm_transfers(values, self.pwm_values):
+            with device as i2c:
+                i2c.write(data)
+        self.pwm_values.update(values)
+
 
     # Set the Right Turn servo to the counterclockwise position
     def set_right_turn_m90(self):
         if (DEBUG == 1):
             print("set_right_turn_m90")
         if (self.rt_pos != T_POS_M90):
-            self.set_pwm_value(self.rt, self.rt_cal_m90)
-            self.rt_pos = T_POS_M90
-            sleep(SERVO_MOVE_DELAY)
+            self.move_group([(RT, T_POS_M90)])
 
 
     # Set the Right Turn servo to the center (horizontal) position
@@ -137,9 +497,7 @@ class RubikServo(object):
         if (DEBUG == 1):
             print("set_right_turn_0")
         if (self.rt_pos != T_POS_0):
-            self.set_pwm_value(self.rt, self.rt_cal_0)
-            self.rt_pos = T_POS_0
-            sleep(SERVO_MOVE_DELAY)
+            self.move_group([(RT, T_POS_0)])
 
 
     # Set the Right Turn servo to the clockwise position
@@ -148,9 +506,7 @@ class RubikServo(object):
         if (DEBUG == 1):
             print("set_right_turn_90")
         if (self.rt_pos != T_POS_P90):
-            self.set_pwm_value(self.rt, self.rt_cal_90)
-            self.rt_pos = T_POS_P90
-            sleep(SERVO_MOVE_DELAY)
+            self.move_group([(RT, T_POS_P90)])
 
 
     # Set the Right Grip server to the open position
@@ -159,14 +515,7 @@ class RubikServo(object):
         if (DEBUG == 1):
             print("set_right_grip_open")
         if (self.rg_pos != G_POS_OPEN):
-            if (self.rg_pos == G_POS_CLOSED):
-                # Open just a little first to avoid messing up the cube
-                self.set_pwm_value(self.rg, \
-                             int((self.rg_cal_close + self.rg_cal_load)/2))
-                sleep(SERVO_MOVE_DELAY / 4)
-            self.set_pwm_value(self.rg, self.rg_cal_open)
-            self.rg_pos = G_POS_OPEN
-            sleep(SERVO_MOVE_DELAY)
+            self.move_group([(RG, G_POS_OPEN)])
 
 
     # Set the Right Grip server to the cube load position
@@ -175,9 +524,7 @@ class RubikServo(object):
         if (DEBUG == 1):
             print("set_right_grip_load")
         if (self.rg_pos != G_POS_LOAD):
-            self.set_pwm_value(self.rg, self.rg_cal_load)
-            self.rg_pos = G_POS_LOAD
-            sleep(SERVO_MOVE_DELAY)
+            self.move_group([(RG, G_POS_LOAD)])
 
 
     # Set the Right Grip server to the closed position
@@ -186,9 +533,7 @@ class RubikServo(object):
         if (DEBUG == 1):
             print("set_right_grip_closed")
         if (self.rg_pos != G_POS_CLOSED):
-            self.set_pwm_value(self.rg, self.rg_cal_close)
-            self.rg_pos = G_POS_CLOSED
-            sleep(SERVO_MOVE_DELAY)
+            self.move_group([(RG, G_POS_CLOSED)])
 
 
     # Set the Left Turn servo to the counterclockwise position
@@ -197,9 +542,7 @@ class RubikServo(object):
         if (DEBUG == 1):
             print("set_left_turn_m90")
         if (self.lt_pos != T_POS_M90):
-            self.set_pwm_value(self.lt, self.lt_cal_m90)
-            self.lt_pos = T_POS_M90
-            sleep(SERVO_MOVE_DELAY)
+            self.move_group([(LT, T_POS_M90)])
 
 
     # Set the Left Turn servo to the center (horizontal) position
@@ -208,9 +551,7 @@ class RubikServo(object):
         if (DEBUG == 1):
             print("set_left_turn_0")
         if (self.lt_pos != T_POS_0):
-            self.set_pwm_value(self.lt, self.lt_cal_0)
-            self.lt_pos = T_POS_0
-            sleep(SERVO_MOVE_DELAY)
+            self.move_group([(LT, T_POS_0)])
 
 
     # Set the Left Turn servo to the clockwise position
@@ -219,9 +560,7 @@ class RubikServo(object):
         if (DEBUG == 1):
             print("set_left_turn_90")
         if (self.lt_pos != T_POS_P90):
-            self.set_pwm_value(self.lt, self.lt_cal_90)
-            self.lt_pos = T_POS_P90
-            sleep(SERVO_MOVE_DELAY)
+            self.move_group([(LT, T_POS_P90)])
 
 
     # Set the Left Grip server to the open position
@@ -230,14 +569,7 @@ class RubikServo(object):
         if (DEBUG == 1):
             print("set_left_grip_open")
         if (self.lg_pos != G_POS_OPEN):
-            if (self.lg_pos == G_POS_CLOSED):
-                # Open just a little first to avoid messing up the cube
-                self.set_pwm_value(self.lg, \
-                             int((self.lg_cal_close + self.lg_cal_load)/2))
-                sleep(SERVO_MOVE_DELAY / 4)
-            self.set_pwm_value(self.lg, self.lg_cal_open)
-            self.lg_pos = G_POS_OPEN
-            sleep(SERVO_MOVE_DELAY)
+            self.move_group([(LG, G_POS_OPEN)])
 
 
     # Set the Left Grip server to the cube load position
@@ -246,9 +578,7 @@ class RubikServo(object):
         if (DEBUG == 1):
             print("set_left_grip_load")
         if (self.lg_pos != G_POS_LOAD):
-            self.set_pwm_value(self.lg, self.lg_cal_load)
-            self.lg_pos = G_POS_LOAD
-            sleep(SERVO_MOVE_DELAY)
+            self.move_group([(LG, G_POS_LOAD)])
 
 
     # Set the Left Grip server to the closed position
@@ -257,23 +587,17 @@ class RubikServo(object):
         if (DEBUG == 1):
             print("set_left_grip_closed")
         if (self.lg_pos != G_POS_CLOSED):
-            self.set_pwm_value(self.lg, self.lg_cal_close)
-            self.lg_pos = G_POS_CLOSED
-            sleep(SERVO_MOVE_DELAY)
+            self.move_group([(LG, G_POS_CLOSED)])
 
 
     def cube_load(self, btn_q):
         if(DEBUG == 1):
             print("cube_load")
         # Make sure the turn servos are horizontal
-        self.set_right_turn_0()
-        self.set_left_turn_0()
+        self.run_moves([(RT, T_POS_0), (LT, T_POS_0)])
         # Put the grippers into the load cube position
-        self.set_pwm_value(self.rg, self.rg_cal_load)
-        self.rg_pos = G_POS_LOAD
-        self.set_pwm_value(self.lg, self.lg_cal_load)
-        self.lg_pos = G_POS_LOAD
-        sleep(SERVO_MOVE_DELAY)
+        # Both grippers move at once
+        self.move_group([(RG, G_POS_LOAD), (LG, G_POS_LOAD)])
 
         while 1:
             # Wait for a button event
@@ -281,270 +605,87 @@ class RubikServo(object):
             button_press = ENTER_BUTTON
             if (button_press == ENTER_BUTTON):
                 # Close the grippers
-                self.set_pwm_value(self.rg, self.rg_cal_close)
-                self.rg_pos = G_POS_CLOSED
-                self.set_pwm_value(self.lg, self.lg_cal_close)
-                self.lg_pos = G_POS_CLOSED
-                sleep(SERVO_MOVE_DELAY)
+                # Both grippers move at once
+                self.move_group([(RG, G_POS_CLOSED), (LG, G_POS_CLOSED)])
                 break
 
 
     # Open both grippers so the cube can be removed
+    # This is where an aborted solve ends up, so it can't be aborted.
     #
     def cube_release(self):
-        if(DEBUG == 1):
-            print("cube_release")
-        if (self.rt_pos != T_POS_0):
-            self.set_right_grip_open()
-            self.set_right_turn_0()
-            self.set_right_grip_closed()
-        if (self.lt_pos != T_POS_0):
-            self.set_left_grip_open()
-            self.set_left_turn_0()
-            self.set_left_grip_closed()
-        self.set_pwm_value(self.rg, self.rg_cal_load)
-        self.rg_pos = G_POS_LOAD
-        self.set_pwm_value(self.lg, self.lg_cal_load)
-        self.lg_pos = G_POS_LOAD
-        sleep(SERVO_MOVE_DELAY)
+        token = self.token
+        self.token = None
+        try:
+            self.transition("cube_release")
+            # Both grippers move at once
+            self.move_group([(RG, G_POS_LOAD), (LG, G_POS_LOAD)])
+        finally:
+            self.token = token
 
 
     # Make sure the right gripper doesn't block the camera
     def clear_camera(self):
-        if(DEBUG == 1):
-            print("clear_camera")
-        if (self.rt_pos != T_POS_0):
-            self.set_right_grip_open()
-            self.set_right_turn_0()
-            self.set_right_grip_closed()
+        self.transition("clear_camera")
 
     # Use the right gripper to rotate the cube 90 degrees clockwise
     def right_rotate_cube_90_cw(self):
-        if(DEBUG == 1):
-            print("right_rotate_cube_90_cw")
-        if (self.lt_pos != T_POS_0):
-            self.set_left_grip_open()
-            self.set_left_turn_0()
-        if (self.rt_pos == T_POS_P90):
-            self.set_left_grip_closed()
-            self.set_right_grip_open()
-            self.set_right_turn_0()
-            self.set_right_grip_closed()
-        self.set_left_grip_open()
-        if (self.rt_pos == T_POS_0):
-            self.set_right_turn_90()
-        else:
-            self.set_right_turn_0()
-        self.set_left_grip_closed()
+        self.transition("right_rotate_cube_90_cw")
 
 
     # Use the right gripper to rotate the cube 90 degrees counterclockwise
     def right_rotate_cube_90_ccw(self):
-        if(DEBUG == 1):
-            print("right_rotate_cube_90_ccw")
-        if (self.lt_pos != T_POS_0):
-            self.set_left_grip_open()
-            self.set_left_turn_0()
-        if (self.rt_pos == T_POS_M90):
-            self.set_left_grip_closed()
-            self.set_right_grip_open()
-            self.set_right_turn_0()
-            self.set_right_grip_closed()
-        self.set_left_grip_open()
-        if (self.rt_pos == T_POS_0):
-            self.set_right_turn_m90()
-        else:
-            self.set_right_turn_0()
-        self.set_left_grip_closed()
+        self.transition("right_rotate_cube_90_ccw")
 
 
     # Use the right gripper to rotate the cube 180 degrees
     def right_rotate_cube_180(self):
-        if(DEBUG == 1):
-            print("right_rotate_cube_180")
-        if (self.lt_pos != T_POS_0):
-            self.set_left_grip_open()
-            self.set_left_turn_0()
-        if (self.rt_pos == T_POS_0):
-            self.set_left_grip_closed()
-            self.set_right_grip_open()
-            self.set_right_turn_m90()
-            self.set_right_grip_closed()
-        self.set_left_grip_open()
-        if (self.rt_pos == T_POS_M90):
-            self.set_right_turn_90()
-        else:
-            self.set_right_turn_m90()
-        self.set_left_grip_closed()
+        self.transition("right_rotate_cube_180")
 
 
     # Use the right gripper to rotate a face 90 degrees clockwise
     def right_rotate_face_90_cw(self):
-        if(DEBUG == 1):
-            print("right_rotate_face_90_cw")
-        if (self.lt_pos != T_POS_0):
-            self.set_left_grip_open()
-            self.set_left_turn_0()
-            self.set_left_grip_closed()
-        if (self.rt_pos == T_POS_P90):
-            self.set_right_grip_open()
-            self.set_right_turn_0()
-            self.set_right_grip_closed()
-        if (self.rt_pos == T_POS_M90):
-            self.set_right_turn_0()
-        else:
-            self.set_right_turn_90()
+        self.transition("right_rotate_face_90_cw")
 
 
     # Use the right gripper to rotate a face 90 degrees counterclockwise
     def right_rotate_face_90_ccw(self):
-        if(DEBUG == 1):
-            print("right_rotate_face_90_ccw")
-        if (self.lt_pos != T_POS_0):
-            self.set_left_grip_open()
-            self.set_left_turn_0()
-            self.set_left_grip_closed()
-        if (self.rt_pos == T_POS_M90):
-            self.set_right_grip_open()
-            self.set_right_turn_0()
-            self.set_right_grip_closed()
-        if (self.rt_pos == T_POS_M90):
-            self.set_right_turn_0()
-        else:
-            self.set_right_turn_m90()
+        self.transition("right_rotate_face_90_ccw")
 
 
     # Use the right gripper to rotate a face 180 degrees
     def right_rotate_face_180(self):
-        if(DEBUG == 1):
-            print("right_rotate_face_180")
-        if (self.lt_pos != T_POS_0):
-            self.set_left_grip_open()
-            self.set_left_turn_0()
-            self.set_left_grip_closed()
-        if (self.rt_pos == T_POS_0):
-            self.set_right_grip_open()
-            self.set_right_turn_m90()
-            self.set_right_grip_closed()
-        if (self.rt_pos == T_POS_P90):
-            self.set_right_turn_m90()
-        else:
-            self.set_right_turn_90()
+        self.transition("right_rotate_face_180")
 
 
     # Use the left gripper to rotate the cube 90 degrees clockwise
     def left_rotate_cube_90_cw(self):
-        if(DEBUG == 1):
-            print("left_rotate_cube_90_cw")
-        if (self.rt_pos != T_POS_0):
-            self.set_right_grip_open()
-            self.set_right_turn_0()
-        if (self.lt_pos == T_POS_P90):
-            self.set_right_grip_closed()
-            self.set_left_grip_open()
-            self.set_left_turn_0()
-            self.set_left_grip_closed()
-        self.set_right_grip_open()
-        if (self.lt_pos == T_POS_0):
-            self.set_left_turn_90()
-        else:
-            self.set_left_turn_0()
-        self.set_right_grip_closed()
+        self.transition("left_rotate_cube_90_cw")
 
 
     # Use the left gripper to rotate the cube 90 degrees counterclockwise
     def left_rotate_cube_90_ccw(self):
-        if(DEBUG == 1):
-            print("left_rotate_cube_90_ccw")
-        if (self.rt_pos != T_POS_0):
-            self.set_right_grip_open()
-            self.set_right_turn_0()
-        if (self.lt_pos == T_POS_M90):
-            self.set_right_grip_closed()
-            self.set_left_grip_open()
-            self.set_left_turn_0()
-            self.set_left_grip_closed()
-        self.set_right_grip_open()
-        if (self.lt_pos == T_POS_0):
-            self.set_left_turn_m90()
-        else:
-            self.set_left_turn_0()
-        self.set_right_grip_closed()
+        self.transition("left_rotate_cube_90_ccw")
 
 
     # Use the left gripper to rotate the cube 180 degrees
     def left_rotate_cube_180(self):
-        if(DEBUG == 1):
-            print("left_rotate_cube_180")
-        # Make sure the right gripper won't be in the way
-        if (self.rt_pos != T_POS_0):
-            self.set_right_grip_open()
-            self.set_right_turn_0()
-        if (self.lt_pos == T_POS_0):
-            self.set_right_grip_closed()
-            self.set_left_grip_open()
-            self.set_left_turn_m90()
-            self.set_left_grip_closed()
-        self.set_right_grip_open()
-        if (self.lt_pos == T_POS_M90):
-            self.set_left_turn_90()
-        else:
-            self.set_left_turn_m90()
-        self.set_right_grip_closed()
+        self.transition("left_rotate_cube_180")
 
 
     # Use the left gripper to rotate a face 90 degrees clockwise
     def left_rotate_face_90_cw(self):
-        if(DEBUG == 1):
-            print("left_rotate_face_90_cw")
-        if (self.rt_pos != T_POS_0):
-            self.set_right_grip_open()
-            self.set_right_turn_0()
-            self.set_right_grip_closed()
-        if (self.lt_pos == T_POS_P90):
-            self.set_left_grip_open()
-            self.set_left_turn_0()
-            self.set_left_grip_closed()
-        if (self.lt_pos == T_POS_M90):
-            self.set_left_turn_0()
-        else:
-            self.set_left_turn_90()
+        self.transition("left_rotate_face_90_cw")
 
 
     # Use the left gripper to rotate a face 90 degrees counterclockwise
     def left_rotate_face_90_ccw(self):
-        if(DEBUG == 1):
-            print("left_rotate_face_90_ccw")
-        if (self.rt_pos != T_POS_0):
-            self.set_right_grip_open()
-            self.set_right_turn_0()
-            self.set_right_grip_closed()
-        if (self.lt_pos == T_POS_M90):
-            self.set_left_grip_open()
-            self.set_left_turn_0()
-            self.set_left_grip_closed()
-        if (self.lt_pos == T_POS_P90):
-            self.set_left_turn_0()
-        else:
-            self.set_left_turn_m90()
+        self.transition("left_rotate_face_90_ccw")
 
 
     # Use the left gripper to rotate a face 180 degrees 
     def left_rotate_face_180(self):
-        if(DEBUG == 1):
-            print("left_rotate_face_180")
-        if (self.rt_pos != T_POS_0):
-            self.set_right_grip_open()
-            self.set_right_turn_0()
-            self.set_right_grip_closed()
-        if (self.lt_pos == T_POS_0):
-            self.set_left_grip_open()
-            self.set_left_turn_m90()
-            self.set_left_grip_closed()
-        if (self.lt_pos == T_POS_P90):
-            self.set_left_turn_m90()
-        else:
-            self.set_left_turn_90()
+        self.transition("left_rotate_face_180")
 
 
     # Calibrate a single servo
@@ -633,3 +774,71 @@ class RubikServo(object):
         f.write(str(self.lg_cal_open) + " Left grip open\n")
         f.write(str(self.lg_cal_load) + " Left grip cube load\n")
         f.close()
+
+
+# Servo timing model
+# Runs the servo primitives without moving anything and adds up the time
+# the servo delays would take. The primitives skip moves to positions
+# the servos are already in, so the time depends on where they start.
+#
+class ServoTimeModel(RubikServo):
+    def __init__(self, servos=None):
+        if (servos is not None):
+            # Start from the state and calibration of the real servos
+            for name, value in vars(servos).items():
+                if (name not in ("pca", "btn_q", "profiler")):
+                    setattr(self, name, value)
+        else:
+            # Move times depend on the calibration, use the saved one
+            self.cal_file = "servo_tune.txt"
+            self.timing_file = SERVO_TIMING_FILE
+            self.profile_file = SERVO_PROFILE_FILE
+            try:
+                self.read_calibration()
+            except (IOError, ValueError, IndexError):
+                for name in ("rg", "rt", "lg", "lt", \
+                             "rt_cal_m90", "rt_cal_0", "rt_cal_90", \
+                             "rg_cal_close", "rg_cal_open", "rg_cal_load", \
+                             "lt_cal_m90", "lt_cal_0", "lt_cal_90", \
+                             "lg_cal_close", "lg_cal_open", "lg_cal_load"):
+                    setattr(self, name, 0)
+            self.read_timing()
+            self.read_profile()
+            # Cube held by both grippers, turn servos horizontal
+            self.rt_pos = T_POS_0
+            self.lt_pos = T_POS_0
+            self.rg_pos = G_POS_CLOSED
+            self.lg_pos = G_POS_CLOSED
+            self.transitions = TransitionTable(self.move_time)
+        self.pending = None
+        self.pwm_values = {}
+        # Ramped moves are timed but not run
+        self.profiler = None
+        # Model runs aren't aborted
+        self.token = None
+        # Simulated time (seconds), number of PWM values written and the
+        # I2C transfers and bytes that took
+        self.elapsed = 0.0
+        self.writes = 0
+        self.transfers = 0
+        self.bus_bytes = 0
+
+    def check_abort(self):
+        pass
+
+    def write_pwm(self, values):
+        self.writes += len(values)
+        for data in pwm_transfers(values, self.pwm_values):
+            self.transfers += 1
+            self.bus_bytes += len(data)
+        self.pwm_values.update(values)
+
+    def wait(self, seconds):
+        self.elapsed += seconds
+
+    # Run a list of primitives by name, overlapping independent moves
+    # like the robot does
+    # Returns the total simulated time (seconds)
+    def run(self, primitives):
+        self.run_primitives(primitives)
+        return self.elapsed
@@ -0,0 +1,106 @@
+import sqlite3
+from collections import OrderedDict
+
+
+# Solution cache file name
+SOLVE_CACHE_FILE = "solve_cache.db"
+
+# Number of solutions kept in memory
+SOLVE_CACHE_SIZE = 256
+
+# Letters allowed in a cube definition string
+CUBE_FACES = "URFDLB"
+
+
+# Solution cache
+#
+# Solutions are looked up by the 54 character cube definition string and
+# the search parameters they were found with. Recent solutions are kept
+# in memory, every solution is also stored in an SQLite file so the
+# cache survives restarts.
+#
+class SolutionCache(object):
+    def __init__(self, file=SOLVE_CACHE_FILE, size=SOLVE_CACHE_SIZE):
+        # Most recently used solutions at the end
+        self.mem = OrderedDict()
+        self.size = size
+        # Hit and miss counters
+        self.hits = 0
+        self.misses = 0
+
+        self.db = None
+        if (file is not None):
+            self.db = sqlite3.connect(file)
+            # Files written before the search mode was part of the key
+            # can't tell the solutions apart, they are started again
+            columns = [row[1] for row in \
+                       self.db.execute("PRAGMA table_info(solutions)")]
+            if (columns and ("mode" not in columns)):
+                self.db.execute("DROP TABLE solutions")
+            self.db.execute("CREATE TABLE IF NOT EXISTS solutions ("
+                            "cube TEXT NOT NULL, "
+                            "max_length INTEGER NOT NULL, "
+                            "timeout REAL NOT NULL, "
+                            "mode TEXT NOT NULL, "
+                            "solution TEXT NOT NULL, "
+                            "PRIMARY KEY (cube, max_length, timeout, mode))")
+            self.db.commit()
+
+    # Cache key of a cube and the search parameters
+    # The mode tells searches apart that can pick different solutions
+    # with the same length and time limits, "" for a plain solver call.
+    # Returns None if the cube string isn't a valid definition string.
+    def key(self, cube_string, max_length, timeout, mode=""):
+        cube = cube_string.strip().upper()
+        if ((len(cube) != 54) or any(c not in CUBE_FACES for c in cube)):
+            return None
+        return (cube, int(max_length), float(timeout), mode)
+
+    # Look up a solution, returns None if it isn't cached
+    def get(self, cube_string, max_length, timeout, mode=""):
+        key = self.key(cube_string, max_length, timeout, mode)
+        if (key is None):
+            return None
+
+        if key in self.mem:
+            self.mem.move_to_end(key)
+            self.hits += 1
+            return self.mem[key]
+
+        if (self.db is not None):
+            row = self.db.execute("SELECT solution FROM solutions "
+                                  "WHERE cube = ? AND max_length = ? "
+                                  "AND timeout = ? AND mode = ?", \
+                                  key).fetchone()
+            if (row is not None):
+                self.remember(key, row[0])
+                self.hits += 1
+                return row[0]
+
+        self.misses += 1
+        return None
+
+    # Save a solution
+    # Solver error messages are not cached.
+    def put(self, cube_string, max_length, timeout, solution, mode=""):
+        key = self.key(cube_string, max_length, timeout, mode)
+        if ((key is None) or solution.startswith("Error")):
+            return
+        self.remember(key, solution)
+        if (self.db is not None):
+            self.db.execute("INSERT OR REPLACE INTO solutions "
+                            "VALUES (?, ?, ?, ?, ?)", key + (solution,))
+            self.db.commit()
+
+    # Put a solution in the memory cache, dropping the least recently
+    # used one when the cache is full
+    def remember(self, key, solution):
+        self.mem[key] = solution
+        self.mem.move_to_end(key)
+        while (len(self.mem) > self.size):
+            self.mem.popitem(last=False)
+
+    def close(self):
+        if (self.db is not None):
+            self.db.close()
+            self.db = None
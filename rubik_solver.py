@@ -0,0 +1,430 @@
+import queue
+import threading
+import multiprocessing
+from time import monotonic
+
+# Solution string parsing
+from rubik_moves import parse_solution
+# Cube rotations for the parallel searches
+from rubik_cube import ROTATIONS, rotate_cube, unrotate_moves, format_moves
+# Aborting a solve
+from rubik_cancel import CANCEL_POLL
+
+
+# Cube used to exercise the solver once its tables are loaded
+SOLVED_CUBE = "UUUUUUUUURRRRRRRRRFFFFFFFFFDDDDDDDDDLLLLLLLLLBBBBBBBBB"
+
+# Warm up stages
+WARMUP_WAITING = "waiting"        # Thread not started yet
+WARMUP_LOADING = "loading tables" # Importing the solver, loads the tables
+WARMUP_TESTING = "test solve"     # First solve with the loaded tables
+WARMUP_PROCESSES = "starting processes" # Parallel search processes
+WARMUP_READY   = "ready"
+WARMUP_FAILED  = "failed"
+
+# The two phase solver already searches the cube turned about the
+# U-R-F corner diagonal (and the inverse) in every solve. The parallel
+# searches start from rotations that are not one of those turns of each
+# other, so no two processes repeat a search.
+DIAGONAL_TURN = {"U": "R", "R": "F", "F": "U", "D": "L", "L": "B", "B": "D"}
+
+
+# Search for solutions of falling length within a time budget
+#
+# Every solution found is followed by a search for a shorter one, until
+# the time is up, no shorter solution turns up or the caller stops.
+#
+# Inputs:
+#   engine       Two phase solver module
+#   cube_string  54 character cube definition string
+#   timeout      Seconds available for all the searches
+#   max_length   Longest solution wanted
+#   patience     Seconds to search for a shorter solution before giving
+#                up, None to search until the time is up
+#   token        Cancellation token, None if the search can't be aborted
+#
+# Yields the solution strings as they are found, each shorter than the
+# one before
+#
+def search_solutions(engine, cube_string, timeout, max_length, patience=None, \
+                     token=None):
+    deadline = monotonic() + timeout
+    length = max_length
+    found = False
+    while 1:
+        left = deadline - monotonic()
+        if (left <= 0):
+            break
+        if (found and (patience is not None)):
+            left = min(left, patience)
+        solution = engine_solve(engine, cube_string, length, left, token)
+        if solution.startswith("Error"):
+            break
+        moves = len(parse_solution(solution))
+        if (found and (moves > length)):
+            # Time ran out before a shorter solution was found
+            break
+        found = True
+        yield solution
+        if (moves == 0):
+            break
+        length = moves - 1
+
+
+# Run one solve of the two phase solver
+# The solver can't be stopped, with a token the solve runs on its own
+# thread so the caller can stop waiting for it. An aborted solve finishes
+# in the background.
+def engine_solve(engine, cube_string, max_length, timeout, token=None):
+    if (token is None):
+        return engine.solve(cube_string, max_length, timeout)
+    token.check()
+    result = []
+    thread = threading.Thread(target=lambda: result.append( \
+                                  engine.solve(cube_string, max_length, \
+                                               timeout)), daemon=True)
+    thread.start()
+    token.join(thread)
+    return result[0]
+
+
+# Solver of a search process, the queue it sends its solutions to and
+# the number of the last search request that was stopped
+worker_engine = None
+worker_results = None
+worker_stop = None
+
+# Load the solver tables when a search process starts
+def worker_init(results, stop):
+    global worker_engine, worker_results, worker_stop
+    import twophase.solver as solver
+    worker_engine = solver
+    worker_results = results
+    worker_stop = stop
+
+# Search one rotated cube in a search process
+# Every solution is sent as soon as it is found, tagged with the request
+# and task numbers, and None is sent when the task is done. The search
+# ends after the solve that is running when the request is stopped.
+def worker_search(request, task, cube_string, timeout, max_length, \
+                  patience=None):
+    if (worker_stop.value < request):
+        for solution in search_solutions(worker_engine, cube_string, \
+                                         timeout, max_length, patience):
+            if (worker_stop.value >= request):
+                break
+            worker_results.put((request, task, solution))
+    worker_results.put((request, task, None))
+
+
+# Rotations for the parallel searches
+# Returns the rotations, none a diagonal turn of another
+def search_rotations():
+    chosen = []
+    covered = []
+    for rotation in ROTATIONS:
+        if rotation in covered:
+            continue
+        chosen.append(rotation)
+        turned = rotation
+        for i in range(0, 3):
+            covered.append(turned)
+            turned = {f: DIAGONAL_TURN[turned[f]] for f in turned}
+    return chosen
+
+
+# Cube solver
+#
+# The two phase solver loads (or on the very first run generates) large
+# pruning tables when it is imported. This thread does that in the
+# background at startup, while the servos are initialized and the cube
+# is loaded, so the first solve doesn't have to.
+#
+class RubikSolver(threading.Thread):
+    def __init__(self, cache=None, processes=0):
+        super().__init__(daemon=True)
+        # Solution cache, None to always search
+        self.cache = cache
+        # Number of parallel search processes, 0 to search in this process
+        # Every process loads its own copy of the solver tables. They are
+        # started by start_processes().
+        self.processes = processes
+        self.pool = None
+        # Solutions sent by the search processes, and the number of the
+        # last search request (stopped when it is this or lower)
+        self.results = None
+        self.stop = None
+        self.request = 0
+        # Set when the warm up has finished (ready or failed)
+        self.done = threading.Event()
+        self.stage = WARMUP_WAITING
+        self.error = None
+        self.engine = None
+        # Warm up start and end times (monotonic seconds)
+        self.t_start = None
+        self.t_end = None
+
+    # Start the search processes
+    # Call this from the main thread before any other thread is started,
+    # the warm up thread included. Forking a process with other threads
+    # running can leave the children stuck on a lock one of the threads
+    # held. The processes load their solver tables in the background.
+    def start_processes(self):
+        if ((self.processes <= 1) or (self.pool is not None)):
+            return
+        self.results = multiprocessing.Queue()
+        self.stop = multiprocessing.Value("i", -1)
+        self.pool = multiprocessing.Pool(self.processes, worker_init, \
+                                         (self.results, self.stop))
+
+    def run(self):
+        self.t_start = monotonic()
+        try:
+            self.stage = WARMUP_LOADING
+            # This library provieds the moves needed to solve the cube.
+            import twophase.solver as solver
+            self.stage = WARMUP_TESTING
+            solver.solve(SOLVED_CUBE, 100, 0.1)
+            self.engine = solver
+            if (self.pool is not None):
+                self.stage = WARMUP_PROCESSES
+                # Every process has loaded its tables once a task is done
+                # The warm up solutions (request 0) are never read.
+                self.pool.starmap(worker_search, \
+                                  [(0, i, SOLVED_CUBE, 0.1, 100) \
+                                   for i in range(0, self.processes)], 1)
+            self.stage = WARMUP_READY
+        except Exception as e:
+            self.error = e
+            self.stage = WARMUP_FAILED
+        self.t_end = monotonic()
+        self.done.set()
+
+    # Warm up progress
+    # Returns the stage name and the seconds spent warming up so far
+    def progress(self):
+        if (self.t_start is None):
+            return self.stage, 0.0
+        if (self.t_end is None):
+            return self.stage, monotonic() - self.t_start
+        return self.stage, self.t_end - self.t_start
+
+    def ready(self):
+        return self.stage == WARMUP_READY
+
+    # Wait for the warm up to finish
+    # Raises the warm up error if the solver couldn't be loaded, and an
+    # AbortException if the token given is cancelled first.
+    def wait_ready(self, timeout=None, token=None):
+        if (token is not None):
+            start = monotonic()
+            while not self.done.wait(CANCEL_POLL):
+                token.check()
+                if ((timeout is not None) and (monotonic() - start > timeout)):
+                    return False
+        if not self.done.wait(timeout):
+            return False
+        if (self.error is not None):
+            raise self.error
+        return True
+
+    # Get the moves needed to solve the cube
+    # Blocks only if the warm up hasn't finished yet.
+    #
+    # Inputs:
+    #   cube_string  54 character cube definition string
+    #   max_length   Longest solution wanted
+    #   timeout      Seconds to search for a shorter solution
+    #
+    # Returns the solver's solution string
+    #
+    def solve(self, cube_string, max_length=100, timeout=5):
+        if (self.cache is not None):
+            solution = self.cache.get(cube_string, max_length, timeout)
+            if (solution is not None):
+                return solution
+
+        if not self.done.is_set():
+            stage, seconds = self.progress()
+            print("Waiting for the solver (" + stage + ", %.1f s)" % seconds)
+        self.wait_ready()
+
+        solution = self.engine.solve(cube_string, max_length, timeout)
+        if ((self.cache is not None) and not solution.startswith("Error")):
+            self.cache.put(cube_string, max_length, timeout, solution)
+        return solution
+
+    # Search the cube in several orientations at once
+    # Each search process works on the cube rotated into its own class of
+    # diagonal turns (see search_rotations), the solver searches the
+    # inverse of each one itself. Their solutions are mapped back to the
+    # cube as it is in the robot.
+    #
+    # Inputs:
+    #   cube_string  54 character cube definition string
+    #   timeout      Seconds all the processes search for
+    #   max_length   Longest solution wanted
+    #   patience     Seconds to wait for a shorter solution from any
+    #                process, None to wait until the time is up
+    #   token        Cancellation token, None if the search can't be aborted
+    #
+    # Yields the solution strings as the processes find them
+    # The searches are stopped when the caller stops reading.
+    #
+    def solve_parallel(self, cube_string, timeout=5, max_length=100, \
+                       patience=None, token=None):
+        rotations = search_rotations()
+        try:
+            starts = [rotate_cube(cube_string, rotation) \
+                      for rotation in rotations]
+        except KeyError:
+            # Not a real cube, let the solver say what is wrong
+            yield from search_solutions(self.engine, cube_string, timeout, \
+                                        max_length, patience, token)
+            return
+
+        self.request += 1
+        request = self.request
+        tasks = []
+        for i in range(0, self.processes):
+            rotation = i % len(rotations)
+            tasks.append(rotations[rotation])
+            self.pool.apply_async(worker_search, \
+                                  (request, i, starts[rotation], \
+                                   timeout, max_length, patience))
+
+        # All processes share the same deadline
+        deadline = monotonic() + timeout + 1.0
+        running = len(tasks)
+        shortest = None
+        improved = None
+        try:
+            while (running > 0):
+                left = deadline - monotonic()
+                if ((improved is not None) and (patience is not None)):
+                    left = min(left, improved + patience - monotonic())
+                if (left <= 0):
+                    break
+                # Look at the token every so often while waiting
+                wait = left if (token is None) else min(left, CANCEL_POLL)
+                try:
+                    got, task, solution = self.results.get(True, wait)
+                except queue.Empty:
+                    if (wait < left):
+                        token.check()
+                        continue
+                    break
+                if (token is not None):
+                    token.check()
+                if (got != request):
+                    # Left over from an earlier request
+                    continue
+                if (solution is None):
+                    running -= 1
+                    continue
+                moves = unrotate_moves(parse_solution(solution), tasks[task])
+                if ((shortest is None) or (len(moves) < shortest)):
+                    shortest = len(moves)
+                    improved = monotonic()
+                yield format_moves(moves)
+        finally:
+            # Searches still running end after their current solve
+            self.stop.value = request
+
+    # Solve the cube, reporting better solutions as they are found
+    # The search stops when the time is up, when the best solution meets
+    # one of the targets or when no shorter solution turns up for the
+    # patience time. The caller can also just stop reading.
+    # The search processes are used when there are any.
+    #
+    # Inputs:
+    #   cube_string  54 character cube definition string
+    #   cost         Function giving the predicted robot seconds of a
+    #                solution string, None to count the moves
+    #   timeout      Seconds to search at most
+    #   max_length   Longest solution wanted
+    #   max_moves    Stop at a solution with this many moves or fewer
+    #   max_cost     Stop at a solution costing this much or less
+    #   patience     Seconds without a shorter solution before stopping
+    #   token        Cancellation token, None if the search can't be aborted
+    #
+    # Yields (solution string, cost) tuples, each better than the last
+    # Raises AbortException when the token is cancelled.
+    #
+    def solve_anytime(self, cube_string, cost=None, timeout=5, max_length=100, \
+                      max_moves=None, max_cost=None, patience=None, token=None):
+        if (cost is None):
+            cost = lambda solution: len(parse_solution(solution))
+        if not self.done.is_set():
+            stage, seconds = self.progress()
+            print("Waiting for the solver (" + stage + ", %.1f s)" % seconds)
+        self.wait_ready(token=token)
+
+        if (self.pool is not None):
+            solutions = self.solve_parallel(cube_string, timeout, max_length, \
+                                            patience, token)
+        else:
+            solutions = search_solutions(self.engine, cube_string, timeout, \
+                                         max_length, patience, token)
+        best = None
+        try:
+            for solution in solutions:
+                value = cost(solution)
+                if ((best is not None) and (value >= best[1])):
+                    continue
+                best = (solution, value)
+                yield best
+                if ((max_moves is not None) and \
+                    (len(parse_solution(solution)) <= max_moves)):
+                    break
+                if ((max_cost is not None) and (value <= max_cost)):
+                    break
+        finally:
+            solutions.close()
+
+    # Get the solution the robot makes in the shortest time
+    # Takes the best solution found by solve_anytime.
+    #
+    # Inputs:
+    #   cube_string  54 character cube definition string
+    #   cost         Function giving the predicted robot seconds of a
+    #                solution string, None to count the moves
+    #   timeout      Seconds to search for candidate solutions
+    #   max_length   Longest solution wanted
+    #   max_moves    Stop at a solution with this many moves or fewer
+    #   max_cost     Stop at a solution costing this much or less
+    #   patience     Seconds without a shorter solution before stopping
+    #   token        Cancellation token, None if the search can't be aborted
+    #   cost_name    Name of the cost function in the solution cache, None
+    #                to not cache the solutions of a cost function
+    #
+    # Returns the solution string and its cost
+    # Raises AbortException when the token is cancelled.
+    #
+    def solve_fastest(self, cube_string, cost=None, timeout=5, max_length=100, \
+                      max_moves=None, max_cost=None, patience=None, token=None, \
+                      cost_name=None):
+        # The solution picked depends on the cost and where the search
+        # stopped, they are part of the cache key
+        mode = None
+        if (cost is None):
+            cost = lambda solution: len(parse_solution(solution))
+            cost_name = "moves"
+        if ((self.cache is not None) and (cost_name is not None)):
+            mode = "fastest %s moves=%s cost=%s patience=%s" % \
+                   (cost_name, max_moves, max_cost, patience)
+            solution = self.cache.get(cube_string, max_length, timeout, mode)
+            if (solution is not None):
+                return solution, cost(solution)
+
+        best = None
+        for best in self.solve_anytime(cube_string, cost, timeout, max_length, \
+                                       max_moves, max_cost, patience, token):
+            pass
+        if (best is None):
+            # Let the solver report what is wrong with the cube
+            return self.engine.solve(cube_string, max_length, 0.1), None
+
+        if (mode is not None):
+            self.cache.put(cube_string, max_length, timeout, best[0], mode)
+        return best
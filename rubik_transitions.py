@@ -0,0 +1,241 @@
+import heapq
+
+
+# Servo positions
+# The actual values aren't important as long as they are unique, here
+# they are also used to number the servo states.
+#
+# Turn servos
+T_POS_M90    = 0    # Counterclockwise 90 degree position
+T_POS_0      = 1    # Center (horizontal) position
+T_POS_P90    = 2    # Clockwise 90 degree position
+# Grip servos
+G_POS_OPEN   = 0    # Grip fully open position
+G_POS_LOAD   = 1    # Grip in the load cube position
+G_POS_CLOSED = 2    # Grip closed position
+
+# Servos, by their place in a servo state
+# A servo state is a (right turn, right grip, left turn, left grip)
+# tuple of positions.
+RT = 0
+RG = 1
+LT = 2
+LG = 3
+
+# Number of servo states
+N_STATES = 81
+
+# Ways a turn servo move can change the cube
+EFFECT_FACE = "face"    # Turns the face the gripper holds
+EFFECT_CUBE = "cube"    # Turns the whole cube
+
+# Servo moves of the servo class primitives
+# Each primitive needs exactly one turn servo move that changes the cube
+# (the gripper, the effect and the quarter turns it can be) and leaves
+# both grippers holding the cube. The 180 degree turns go either way.
+PRIMITIVE_EFFECTS = {
+    "right_rotate_face_90_cw":  (RT, EFFECT_FACE, (1,)),
+    "right_rotate_face_90_ccw": (RT, EFFECT_FACE, (-1,)),
+    "right_rotate_face_180":    (RT, EFFECT_FACE, (2, -2)),
+    "left_rotate_face_90_cw":   (LT, EFFECT_FACE, (1,)),
+    "left_rotate_face_90_ccw":  (LT, EFFECT_FACE, (-1,)),
+    "left_rotate_face_180":     (LT, EFFECT_FACE, (2, -2)),
+    "right_rotate_cube_90_cw":  (RT, EFFECT_CUBE, (1,)),
+    "right_rotate_cube_90_ccw": (RT, EFFECT_CUBE, (-1,)),
+    "right_rotate_cube_180":    (RT, EFFECT_CUBE, (2, -2)),
+    "left_rotate_cube_90_cw":   (LT, EFFECT_CUBE, (1,)),
+    "left_rotate_cube_90_ccw":  (LT, EFFECT_CUBE, (-1,)),
+    "left_rotate_cube_180":     (LT, EFFECT_CUBE, (2, -2))}
+
+# Servo states the other primitives end in
+# clear_camera gets the right gripper out of the camera's view with the
+# cube held by both grippers, cube_release gets both arms horizontal
+# before the grippers open.
+PRIMITIVE_GOALS = {
+    "clear_camera": lambda state: (state[RT] == T_POS_0) and \
+                                  ((not holds_cube(state)) or \
+                                   ((state[RG] == G_POS_CLOSED) and \
+                                    (state[LG] == G_POS_CLOSED))),
+    "cube_release": lambda state: (state[RT] == T_POS_0) and \
+                                  (state[LT] == T_POS_0)}
+
+
+# Number of a servo state
+def state_index(state):
+    return ((state[RT] * 3 + state[RG]) * 3 + state[LT]) * 3 + state[LG]
+
+# Servo state of a number
+def index_state(index):
+    return (index // 27, (index // 9) % 3, (index // 3) % 3, index % 3)
+
+
+# A gripper holds the cube
+def holds_cube(state):
+    return (state[RG] == G_POS_CLOSED) or (state[LG] == G_POS_CLOSED)
+
+
+# What a single servo move does to the cube
+#
+# A turn servo can always turn an open gripper. Turning a closed gripper
+# turns the face it holds when the other gripper holds the cube too, or
+# the whole cube when the other gripper is open. Either way the other
+# arm has to be horizontal. Any other turn would mess up the cube.
+#
+# Inputs:
+#   state    Servo state before the move
+#   servo    Servo moved (RT, RG, LT or LG)
+#   pos      Position the servo moves to
+#
+# Returns None for a move that doesn't change the cube, the effect and
+# the quarter turns for a move that does, or False for a move that isn't
+# allowed
+#
+def move_effect(state, servo, pos):
+    if (servo in (RG, LG)):
+        return None
+    grip = state[servo + 1]
+    if (grip == G_POS_OPEN):
+        return None
+    other_turn = state[2 - servo]
+    other_grip = state[3 - servo]
+    if ((grip != G_POS_CLOSED) or (other_turn != T_POS_0)):
+        return False
+    if (other_grip == G_POS_CLOSED):
+        return (EFFECT_FACE, pos - state[servo])
+    if (other_grip == G_POS_OPEN):
+        return (EFFECT_CUBE, pos - state[servo])
+    return False
+
+
+# A servo move carries the cube
+# A turn servo does when it turns a face or the cube, a grip servo when
+# it closes on the cube or opens from it. Such moves may need gentler
+# speed and acceleration limits.
+#
+# Inputs:
+#   state    Servo state before the move
+#   servo    Servo moved (RT, RG, LT or LG)
+#   pos      Position the servo moves to
+#
+def move_loaded(state, servo, pos):
+    if (servo in (RG, LG)):
+        return (state[servo] == G_POS_CLOSED) or (pos == G_POS_CLOSED)
+    return bool(move_effect(state, servo, pos))
+
+
+# Gripper transition table
+#
+# The servo states are enumerated (3 turn and 3 grip positions for each
+# arm) together with every single servo move between them. For every
+# primitive the fastest servo moves from each state are found once and
+# kept, the primitives are then just a table lookup.
+#
+# While a gripper holds the cube at least one always does. Starting
+# with the cube loose (no gripper closed) no gripper is closed, so only
+# clear_camera and cube_release have moves from those states.
+#
+class TransitionTable(object):
+    def __init__(self, move_time):
+        # Function giving the seconds a servo takes between two positions,
+        # with or without carrying the cube
+        self.move_time = move_time
+        # Servo moves of every primitive, by start state number
+        # Each entry is a tuple of (servo, position) moves, or None if the
+        # primitive can't be done from that state.
+        self.paths = {}
+        # Predicted seconds of every primitive, by start state number
+        self.times = {}
+
+        # Moves into every state, (from state, servo, position, seconds,
+        # effect) tuples
+        into = [[] for i in range(0, N_STATES)]
+        for i in range(0, N_STATES):
+            state = index_state(i)
+            for servo in (RT, RG, LT, LG):
+                for pos in (0, 1, 2):
+                    if (pos == state[servo]):
+                        continue
+                    effect = move_effect(state, servo, pos)
+                    if (effect is False):
+                        continue
+                    nxt = list(state)
+                    nxt[servo] = pos
+                    # The cube can't be dropped or picked up on the way
+                    if (holds_cube(nxt) != holds_cube(state)):
+                        continue
+                    seconds = move_time(servo, state[servo], pos, \
+                                        move_loaded(state, servo, pos))
+                    into[state_index(nxt)].append( \
+                        (i, servo, pos, seconds, effect))
+
+        for name, (servo, kind, turns) in PRIMITIVE_EFFECTS.items():
+            effects = set((kind, quarters) for quarters in turns)
+            goal = lambda state: (state[RG] == G_POS_CLOSED) and \
+                                 (state[LG] == G_POS_CLOSED)
+            self.fill(name, into, goal, servo, effects)
+        for name, goal in PRIMITIVE_GOALS.items():
+            self.fill(name, into, goal)
+
+    # Find the fastest moves from every state to a goal
+    # The search runs backwards from the goal states over (state, effect
+    # made) nodes, so every start state is found in one pass.
+    #
+    # Inputs:
+    #   name     Primitive name
+    #   into     Moves into every state
+    #   goal     Function telling if a servo state ends the primitive
+    #   servo    Turn servo that has to make the effect, None for none
+    #   effects  Effects that servo may make
+    #
+    def fill(self, name, into, goal, servo=None, effects=()):
+        # Seconds to the goal and the next (node, servo, position)
+        best = {}
+        heap = []
+        made = (servo is not None)
+        for i in range(0, N_STATES):
+            if goal(index_state(i)):
+                best[(i, made)] = (0.0, None)
+                heapq.heappush(heap, (0.0, i, made))
+
+        done = set()
+        while heap:
+            seconds, i, has_effect = heapq.heappop(heap)
+            if ((i, has_effect) in done):
+                continue
+            done.add((i, has_effect))
+            for j, s, pos, t, effect in into[i]:
+                if (effect is None):
+                    node = (j, has_effect)
+                elif (has_effect and (s == servo) and (effect in effects)):
+                    # The effect is made by this move, before it it isn't
+                    node = (j, False)
+                else:
+                    continue
+                t += seconds
+                if ((node not in best) or (t < best[node][0])):
+                    best[node] = (t, ((i, has_effect), s, pos))
+                    heapq.heappush(heap, (t, node[0], node[1]))
+
+        paths = [None] * N_STATES
+        times = [None] * N_STATES
+        for i in range(0, N_STATES):
+            node = (i, False)
+            if (node not in best):
+                continue
+            path = []
+            while (best[node][1] is not None):
+                node, s, pos = best[node][1]
+                path.append((s, pos))
+            paths[i] = tuple(path)
+            times[i] = best[(i, False)][0]
+        self.paths[name] = paths
+        self.times[name] = times
+
+    # Servo moves of a primitive from a servo state
+    # Returns a tuple of (servo, position) moves, None if it can't be done
+    def path(self, name, state):
+        return self.paths[name][state_index(state)]
+
+    # Predicted seconds of a primitive from a servo state
+    def time(self, name, state):
+        return self.times[name][state_index(state)]
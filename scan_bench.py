@@ -0,0 +1,125 @@
+# Replay stored scans through the cube scanner and measure it
+#
+# No camera or servos are needed. Every face set is decoded, sampled and
+# classified, and the time of each stage is reported together with the
+# accuracy against the labelled scans.
+#
+# Usage:
+#   python3 scan_bench.py [-n repeat] [folder ...]
+#
+# A face set is a folder holding face0.jpg ... face5.jpg. A folder that
+# holds no face images is searched for face sets one level down. A face
+# set is labelled when it also holds a cube.txt file with the correct
+# 54 character cube string. The Cube folder is used if no folders are
+# given.
+#
+import os
+import io
+import sys
+import argparse
+import contextlib
+from time import perf_counter
+
+from rubik_scan import RubikScan
+from rubik_camera import CameraSession
+
+
+# Label file name in a face set folder
+LABEL_FILE = "cube.txt"
+
+
+# Find the face set folders
+def find_face_sets(folders):
+    sets = []
+    for folder in folders:
+        if os.path.exists(os.path.join(folder, "face0.jpg")):
+            sets.append(folder)
+        else:
+            for name in sorted(os.listdir(folder)):
+                sub = os.path.join(folder, name)
+                if os.path.exists(os.path.join(sub, "face0.jpg")):
+                    sets.append(sub)
+    return sets
+
+
+# Read the correct cube string of a face set, None if not labelled
+def read_label(folder):
+    file = os.path.join(folder, LABEL_FILE)
+    if not os.path.exists(file):
+        return None
+    f = open(file, 'r')
+    label = f.readline().strip()
+    f.close()
+    return label
+
+
+parser = argparse.ArgumentParser(description="Cube scanner benchmark")
+parser.add_argument("-n", "--repeat", type=int, default=1, \
+                    help="number of times every face set is scanned")
+parser.add_argument("folders", nargs="*", default=["Cube"])
+args = parser.parse_args()
+
+sets = find_face_sets(args.folders)
+if (len(sets) == 0):
+    print("No face sets found")
+    sys.exit(1)
+
+# The camera is never used in replay
+scanner = RubikScan(None, CameraSession())
+scanner.replay = True
+
+# Stage times (seconds)
+t_decode = 0.0
+t_sample = 0.0
+t_classify = 0.0
+scans = 0
+failed = 0
+labelled = 0
+correct = 0
+stickers_right = 0
+
+for run in range(0, args.repeat):
+    for folder in sets:
+        scanner.faces.folder = folder
+        scanner.faces.clear()
+
+        t0 = perf_counter()
+        pixels = scanner.faces.get_all()
+        t1 = perf_counter()
+        samples = scanner.sample_faces(pixels)
+        t2 = perf_counter()
+        # The scanner prints its own debug output, keep it out of the report
+        with contextlib.redirect_stdout(io.StringIO()):
+            success, cube_string = scanner.get_colors(samples)
+        t3 = perf_counter()
+
+        t_decode += t1 - t0
+        t_sample += t2 - t1
+        t_classify += t3 - t2
+        scans += 1
+        if not success:
+            failed += 1
+
+        label = read_label(folder)
+        if (label is not None):
+            labelled += 1
+            if (cube_string == label):
+                correct += 1
+            stickers_right += sum(1 for a, b in zip(cube_string, label) \
+                                  if a == b)
+        if (run == 0):
+            print(folder + " " + cube_string + ("" if success else " FAILED"))
+
+total = t_decode + t_sample + t_classify
+print("")
+print(str(len(sets)) + " face sets, " + str(scans) + " scans")
+print("Scans per second: %.1f" % (scans / total))
+print("Decode:   %7.2f ms/scan" % (t_decode * 1000 / scans))
+print("Sample:   %7.2f ms/scan" % (t_sample * 1000 / scans))
+print("Classify: %7.2f ms/scan" % (t_classify * 1000 / scans))
+print("Failed scans: " + str(failed))
+if (labelled > 0):
+    print("Labelled scans correct: %d of %d" % (correct, labelled))
+    print("Sticker accuracy: %.2f%%" % (100.0 * stickers_right / (labelled * 54)))
+else:
+    print("No labelled scans, accuracy not measured")
@@ -0,0 +1,82 @@
+# Run solutions through the servo code on the simulated PWM board
+#
+# No servos, PWM board or Pi are needed. The servos run on a virtual
+# clock, so a solution takes a few milliseconds and the exact robot time
+# is reported, together with the time the move compiler predicted and
+# the PWM board traffic.
+#
+# Usage:
+#   python3 servo_bench.py [-n solves] [-m moves] [-s seed] [--profiles]
+#
+# Every solve is a random list of moves, run from the cube held in the
+# load position. The calibration, timing and profile files are read as
+# on the robot.
+#
+import random
+import argparse
+from queue import Queue
+from time import perf_counter
+
+from rubik_backend import SimPCA9685, VirtualClock
+from rubik_servos import RubikServo
+from rubik_moves import MoveCompiler, optimize_moves, servo_state
+
+
+parser = argparse.ArgumentParser(description="Servo simulation benchmark")
+parser.add_argument("-n", "--solves", type=int, default=10, \
+                    help="number of solves to run")
+parser.add_argument("-m", "--moves", type=int, default=20, \
+                    help="moves in every solve")
+parser.add_argument("-s", "--seed", type=int, default=1, \
+                    help="random seed of the moves")
+parser.add_argument("--profiles", action="store_true", \
+                    help="ramp the servo moves, whatever the profile file says")
+args = parser.parse_args()
+
+clock = VirtualClock()
+pca = SimPCA9685(clock)
+servos = RubikServo(Queue(), pca, clock)
+if args.profiles:
+    servos.set_profiles(True)
+servos.cube_load(None)
+
+t0 = perf_counter()
+compiler = MoveCompiler(servos)
+compiler.prepare()
+print("Compiler tables: %.1f ms" % ((perf_counter() - t0) * 1000))
+
+rng = random.Random(args.seed)
+t_wall = 0.0
+t_robot = 0.0
+t_predicted = 0.0
+writes = len(pca.writes)
+transfers = pca.transfers
+bus_bytes = pca.bus_bytes
+for solve in range(0, args.solves):
+    moves = [(rng.choice("URFDLB"), rng.randint(1, 3)) \
+             for i in range(0, args.moves)]
+    moves = optimize_moves(moves)
+    start = clock.monotonic()
+    t0 = perf_counter()
+    primitives, seconds, end = compiler.compile(moves, None, \
+                                                servo_state(servos))
+    servos.run_primitives(primitives)
+    wall = perf_counter() - t0
+    robot = clock.monotonic() - start
+    t_wall += wall
+    t_robot += robot
+    t_predicted += seconds
+    print("%2d moves, %3d primitives: robot %6.2f s, predicted %6.2f s, " \
+          "run in %5.1f ms" % (len(moves), len(primitives), robot, seconds, \
+                               wall * 1000))
+
+print("")
+print(str(args.solves) + " solves")
+print("Robot time:     %7.2f s/solve" % (t_robot / args.solves))
+print("Predicted time: %7.2f s/solve" % (t_predicted / args.solves))
+print("Wall time:      %7.2f ms/solve" % (t_wall * 1000 / args.solves))
+print("PWM values written: %.1f/solve" % \
+      ((len(pca.writes) - writes) / args.solves))
+print("I2C transfers:      %.1f/solve, %.1f bytes/solve" % \
+      ((pca.transfers - transfers) / args.solves, \
+       (pca.bus_bytes - bus_bytes) / args.solves))